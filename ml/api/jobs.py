@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from utils import env
+from models.admission import Overloaded, BATCH
+
+FINISHED = ("done", "failed")
+
+
+class JobStore:
+    """
+    Очередь заданий генерации в SQLite, переживающая перезапуск сервиса.
+
+    Задание проходит статусы queued -> running -> done/failed. Файл очереди
+    могут делить несколько процессов: выполняемое задание помечено владельцем
+    (owner этого JobStore), который периодически обновляет его heartbeat.
+    Задания, чей heartbeat не обновлялся stale_after секунд (процесс
+    остановлен или упал), возвращаются в очередь, пока число попыток меньше
+    max_attempts. Завершённые задания хранятся ttl секунд.
+    """
+
+    def __init__(self, path=None, ttl=None, max_attempts=None, stale_after=None):
+        self.path = path or env.JOB_DB_PATH
+        self.ttl = ttl or env.JOB_RESULT_TTL
+        self.max_attempts = max_attempts or env.JOB_MAX_ATTEMPTS
+        self.stale_after = stale_after or 3 * env.JOB_HEARTBEAT_INTERVAL
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL, "
+            "result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "created REAL NOT NULL, started REAL, finished REAL)"
+        )
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+        for column in ("owner TEXT", "heartbeat REAL"):
+            if column.split()[0] not in columns:
+                self._connection.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+        self._connection.commit()
+
+    def submit(self, kind, payload):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO jobs (id, kind, payload, status, created) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False), time.time())
+            )
+            self._connection.commit()
+        return job_id
+
+    def claim(self):
+        """Самое старое задание из очереди, переведённое в running, или None."""
+        with self._lock:
+            while True:
+                row = self._connection.execute(
+                    "SELECT id, kind, payload FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                # Условие на статус: задание мог забрать другой процесс с тем же файлом
+                now = time.time()
+                claimed = self._connection.execute(
+                    "UPDATE jobs SET status = 'running', started = ?, attempts = attempts + 1, owner = ?, heartbeat = ? "
+                    "WHERE id = ? AND status = 'queued'",
+                    (now, self.owner, now, row[0])
+                ).rowcount
+                self._connection.commit()
+                if claimed:
+                    return row[0], row[1], json.loads(row[2])
+
+    def heartbeat(self):
+        """Отметка, что задания этого владельца ещё выполняются."""
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE status = 'running' AND owner = ?",
+                (time.time(), self.owner)
+            )
+            self._connection.commit()
+
+    def release(self, job_id):
+        """Задание, которое не удалось начать, снова в очередь; попытка не засчитывается."""
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'queued', started = NULL, owner = NULL, attempts = attempts - 1 "
+                "WHERE id = ? AND status = 'running' AND owner = ?",
+                (job_id, self.owner)
+            )
+            self._connection.commit()
+
+    def finish(self, job_id, result=None, error=None):
+        """
+        Результат записывается, только если задание всё ещё у этого владельца:
+        задание, возвращённое в очередь и взятое другим процессом, не перезаписывается.
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? "
+                "WHERE id = ? AND status = 'running' AND owner = ?",
+                (
+                    "failed" if error is not None else "done",
+                    json.dumps(result, ensure_ascii=False) if error is None else None,
+                    error,
+                    time.time(),
+                    job_id,
+                    self.owner
+                )
+            )
+            self._connection.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id, kind, status, result, error, created, started, finished FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "type": row[1],
+            "status": row[2],
+            "result": json.loads(row[3]) if row[3] is not None else None,
+            "error": row[4],
+            "created": row[5],
+            "started": row[6],
+            "finished": row[7]
+        }
+
+    def recover(self):
+        """
+        Задания остановленных процессов (heartbeat старше stale_after): снова
+        в очередь или в failed. Задания живых процессов не трогаются.
+        """
+        now = time.time()
+        stale = "status = 'running' AND (heartbeat IS NULL OR heartbeat < ?)"
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Interrupted too many times', finished = ? "
+                f"WHERE {stale} AND attempts >= ?",
+                (now, now - self.stale_after, self.max_attempts)
+            )
+            requeued = self._connection.execute(
+                f"UPDATE jobs SET status = 'queued', started = NULL, owner = NULL WHERE {stale}",
+                (now - self.stale_after,)
+            ).rowcount
+            self._connection.commit()
+        return requeued
+
+    def cleanup(self):
+        with self._lock:
+            removed = self._connection.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+                (time.time() - self.ttl,)
+            ).rowcount
+            self._connection.commit()
+        return removed
+
+    def get_stats(self):
+        with self._lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {"queued": 0, "running": 0, "done": 0, "failed": 0, **dict(rows)}
+
+
+class JobQueue:
+    """
+    Пул потоков, выполняющих задания из JobStore.
+
+    handlers - тип задания -> функция (input, bypass_cache), возвращающая
+    ответ модели; ответ с ключом error завершает задание как failed.
+    Задание, которому модель отказала в допуске (Overloaded), возвращается
+    в очередь и повторяется через retry_after секунд. Отдельный поток
+    обновляет heartbeat выполняемых заданий, а задания упавших процессов
+    возвращаются в очередь при запуске и затем каждые cleanup_interval секунд.
+    """
+
+    def __init__(self, handlers, store=None, workers=None, cleanup_interval=60, heartbeat_interval=None):
+        self.handlers = handlers
+        self.store = store or JobStore()
+        self.workers = workers or env.JOB_WORKERS
+        self.cleanup_interval = cleanup_interval
+        self.heartbeat_interval = heartbeat_interval or env.JOB_HEARTBEAT_INTERVAL
+        self._changed = threading.Condition()
+        self._last_cleanup = 0.0
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Запускает рабочие потоки; повторные вызовы ничего не делают."""
+        with self._start_lock:
+            if self._threads:
+                return
+            self.store.recover()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            self.store.heartbeat()
+
+    def submit(self, kind, data, bypass_cache=False):
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job type: {kind}")
+        job_id = self.store.submit(kind, {"input": data, "bypass_cache": bypass_cache})
+        self._notify()
+        return job_id
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def _work(self):
+        while True:
+            self._cleanup()
+            job = self.store.claim()
+            if job is None:
+                with self._changed:
+                    self._changed.wait(1.0)
+                continue
+
+            job_id, kind, payload = job
+            self._notify()
+            try:
+                result = self.handlers[kind](payload["input"], payload["bypass_cache"])
+                error = result.get("error") if isinstance(result, dict) else None
+            except Overloaded as e:
+                self.store.release(job_id)
+                self._notify()
+                time.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                result, error = None, str(e)
+            self.store.finish(job_id, result, error)
+            self._notify()
+
+    def _cleanup(self):
+        now = time.monotonic()
+        with self._changed:
+            if now - self._last_cleanup < self.cleanup_interval:
+                return
+            self._last_cleanup = now
+        self.store.cleanup()
+        if self.store.recover():
+            self._notify()
+
+    def wait(self, job_id, timeout, status=None):
+        """
+        Задание, как только оно завершится (или сменит статус, если задан
+        status), либо его текущее состояние по истечении timeout секунд.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.store.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED or (status is not None and job["status"] != status) or remaining <= 0:
+                return job
+            # Задание может завершить и другой процесс с тем же файлом очереди
+            with self._changed:
+                self._changed.wait(min(remaining, 1.0))
+
+    def events(self, job_id, heartbeat=15):
+        """
+        События задания для SSE: ("status", статус) при каждой смене, в конце
+        ("result", ответ) или ("error", текст); (None, None) - ничего не
+        изменилось за heartbeat секунд.
+        """
+        status = None
+        job = self.store.get(job_id)
+        while True:
+            if job is None:
+                yield "error", "Job not found"
+                return
+            if job["status"] != status:
+                status = job["status"]
+                yield "status", status
+            else:
+                yield None, None
+
+            if status == "done":
+                yield "result", job["result"]
+                return
+            if status == "failed":
+                yield "error", job["error"]
+                return
+            job = self.wait(job_id, heartbeat, status)
+
+    def get_stats(self):
+        return {**self.store.get_stats(), "workers": self.workers}
+
+
+def model_handlers(model):
+    """
+    Задания генерации BaselineModel; типы совпадают с синхронными эндпоинтами
+    server.py. Фоновые генерации идут классом batch и уступают слоты
+    интерактивным запросам.
+    """
+    return {
+        "entry-test": lambda data, bypass_cache: model.generate_entry_test(
+            data, bypass_cache=bypass_cache, priority=BATCH
+        ),
+        "course-graph": lambda data, bypass_cache: model.generate_course_graph(
+            data, bypass_cache=bypass_cache, priority=BATCH
+        ),
+        "lesson-plan": lambda data, bypass_cache: model.generate_lesson_plan(
+            data, data.get('type', 'theory'), bypass_cache=bypass_cache, priority=BATCH
+        ),
+        "lesson-results": lambda data, bypass_cache: model.evaluate_lesson_results(
+            data, bypass_cache=bypass_cache, priority=BATCH
+        )
+    }
@@ -1,176 +1,223 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from datetime import datetime
+import os
+import sys
+import json
 import time
+import asyncio
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils import env
+from models.baseline import BaselineModel
+from models.async_baseline import AsyncBaselineModel
+from models.admission import Overloaded
+from api.jobs import JobQueue, model_handlers
 
 router = APIRouter()
+llm_model = AsyncBaselineModel(env.GENERATING_MODEL)
+# Фоновые задания выполняются в потоках синхронной моделью
+job_queue = JobQueue(model_handlers(BaselineModel(env.GENERATING_MODEL)))
+job_queue.start()
 
 # Модели запросов
 class TestGenerationRequest(BaseModel):
     course_topics: list
     student_interests: str = None
+    course_title: str = ""
+    course_materials: str = ""
 
 class GraphGenerationRequest(BaseModel):
     course_topics: list
     knowledge_gaps: list
     interests: str
+    course_title: str = ""
 
 class LessonGenerationRequest(BaseModel):
     lesson_topic: str
     course_materials: str
     interests: str
     student_level: str
+    lesson_type: str = "theory"
+    knowledge_gaps: list = []
 
 class ProgressReportRequest(BaseModel):
     student_performance: dict
     lesson_feedback: str
     test_results: dict
 
+def _response(result, start_time):
+    if 'error' in result:
+        raise HTTPException(status_code=500, detail=result['error'])
+
+    return {
+        "success": True,
+        "data": result,
+        "metadata": {
+            "total_time": time.time() - start_time,
+            "timestamp": datetime.now().isoformat()
+        }
+    }
+
+def _overloaded(e):
+    """Отказ в допуске к модели: 429 или 503 с Retry-After, без ожидания генерации."""
+    return HTTPException(status_code=e.status, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def _test_input(request: TestGenerationRequest):
+    return {
+        'course_title': request.course_title,
+        'topics': request.course_topics,
+        'materials': request.course_materials,
+        'interests': request.student_interests
+    }
+
+def _graph_input(request: GraphGenerationRequest):
+    return {
+        'student_profile': {
+            'interests': request.interests,
+            'knowledge_gaps': request.knowledge_gaps
+        },
+        'course_title': request.course_title,
+        'topics': request.course_topics
+    }
+
+def _lesson_input(request: LessonGenerationRequest):
+    return {
+        'lesson_parameters': {
+            'topic': request.lesson_topic,
+            'student_profile': {
+                'interests': request.interests,
+                'knowledge_gaps': request.knowledge_gaps,
+                'level': request.student_level
+            }
+        },
+        'theory': request.course_materials,
+        'type': request.lesson_type
+    }
+
+def _report_input(request: ProgressReportRequest):
+    return {
+        **request.student_performance,
+        'lesson_feedback': request.lesson_feedback,
+        'test': request.test_results
+    }
+
 @router.post("/generate-test")
 async def generate_placement_test(request: TestGenerationRequest):
     """Генерация входного тестирования"""
+    start_time = time.time()
     try:
-        from ml.api.server import llm_model
-        
-        if not llm_model or not llm_model.model_available:
-            raise HTTPException(status_code=503, detail="LLM модель не доступна")
-        
-        start_time = time.time()
-        result = llm_model.generate_placement_test(
-            request.course_topics,
-            request.student_interests
-        )
-        end_time = time.time()
-        
-        if not result.get('success'):
-            raise HTTPException(status_code=500, detail=result.get('error', 'Ошибка генерации'))
-        
-        return {
-            "success": True,
-            "data": result['parsed_data'],
-            "metadata": {
-                "latency": result['latency'],
-                "total_time": end_time - start_time,
-                "tokens_used": result.get('tokens_used', 0),
-                "timestamp": datetime.now().isoformat()
-            }
-        }
-        
+        result = await llm_model.generate_entry_test(_test_input(request))
+    except Overloaded as e:
+        raise _overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return _response(result, start_time)
 
 @router.post("/generate-graph")
 async def generate_learning_graph(request: GraphGenerationRequest):
     """Генерация графа обучения"""
+    start_time = time.time()
     try:
-        from ml.api.server import llm_model
-        
-        if not llm_model or not llm_model.model_available:
-            raise HTTPException(status_code=503, detail="LLM модель не доступна")
-        
-        start_time = time.time()
-        result = llm_model.generate_learning_graph(
-            request.course_topics,
-            request.knowledge_gaps,
-            request.interests
-        )
-        end_time = time.time()
-        
-        if not result.get('success'):
-            raise HTTPException(status_code=500, detail=result.get('error', 'Ошибка генерации'))
-        
-        return {
-            "success": True,
-            "data": result['parsed_data'],
-            "metadata": {
-                "latency": result['latency'],
-                "total_time": end_time - start_time,
-                "tokens_used": result.get('tokens_used', 0),
-                "timestamp": datetime.now().isoformat()
-            }
-        }
-        
+        result = await llm_model.generate_course_graph(_graph_input(request))
+    except Overloaded as e:
+        raise _overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return _response(result, start_time)
 
 @router.post("/generate-lesson")
 async def generate_lesson_plan(request: LessonGenerationRequest):
     """Генерация плана урока"""
+    start_time = time.time()
     try:
-        from ml.api.server import llm_model
-        
-        if not llm_model or not llm_model.model_available:
-            raise HTTPException(status_code=503, detail="LLM модель не доступна")
-        
-        start_time = time.time()
-        result = llm_model.generate_lesson_plan(
-            request.lesson_topic,
-            request.course_materials,
-            request.interests,
-            request.student_level
-        )
-        end_time = time.time()
-        
-        if not result.get('success'):
-            raise HTTPException(status_code=500, detail=result.get('error', 'Ошибка генерации'))
-        
-        return {
-            "success": True,
-            "data": result['parsed_data'],
-            "metadata": {
-                "latency": result['latency'],
-                "total_time": end_time - start_time,
-                "tokens_used": result.get('tokens_used', 0),
-                "timestamp": datetime.now().isoformat()
-            }
-        }
-        
+        result = await llm_model.generate_lesson_plan(_lesson_input(request), request.lesson_type)
+    except Overloaded as e:
+        raise _overloaded(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return _response(result, start_time)
 
 @router.post("/generate-report")
 async def generate_progress_report(request: ProgressReportRequest):
     """Генерация отчёта о прогрессе"""
+    start_time = time.time()
     try:
-        from ml.api.server import llm_model
-        
-        if not llm_model or not llm_model.model_available:
-            raise HTTPException(status_code=503, detail="LLM модель не доступна")
-        
-        start_time = time.time()
-        result = llm_model.generate_progress_report(
-            request.student_performance,
-            request.lesson_feedback,
-            request.test_results
-        )
-        end_time = time.time()
-        
-        if not result.get('success'):
-            raise HTTPException(status_code=500, detail=result.get('error', 'Ошибка генерации'))
-        
-        return {
-            "success": True,
-            "data": result['parsed_data'],
-            "metadata": {
-                "latency": result['latency'],
-                "total_time": end_time - start_time,
-                "tokens_used": result.get('tokens_used', 0),
-                "timestamp": datetime.now().isoformat()
-            }
-        }
-        
+        result = await llm_model.evaluate_lesson_results(_report_input(request))
+    except Overloaded as e:
+        raise _overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return _response(result, start_time)
+
+async def _submit(kind, data):
+    # Очередь заданий - SQLite: запись идёт в потоке, а не в цикле событий
+    job_id = await asyncio.to_thread(job_queue.submit, kind, data)
+    return JSONResponse({"job_id": job_id, "status": "queued"}, status_code=202, headers={"Location": f"/jobs/{job_id}"})
+
+@router.post("/jobs/generate-test", status_code=202)
+async def submit_placement_test(request: TestGenerationRequest):
+    """Входное тестирование в фоне: 202 и id задания"""
+    return await _submit("entry-test", _test_input(request))
+
+@router.post("/jobs/generate-graph", status_code=202)
+async def submit_learning_graph(request: GraphGenerationRequest):
+    """Граф обучения в фоне: 202 и id задания"""
+    return await _submit("course-graph", _graph_input(request))
+
+@router.post("/jobs/generate-lesson", status_code=202)
+async def submit_lesson_plan(request: LessonGenerationRequest):
+    """План урока в фоне: 202 и id задания"""
+    return await _submit("lesson-plan", _lesson_input(request))
+
+@router.post("/jobs/generate-report", status_code=202)
+async def submit_progress_report(request: ProgressReportRequest):
+    """Отчёт о прогрессе в фоне: 202 и id задания"""
+    return await _submit("lesson-results", _report_input(request))
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Состояние задания; с wait ответ ждёт завершения до wait секунд (long-poll)"""
+    wait = min(wait, env.JOB_WAIT_TIMEOUT)
+    if wait > 0:
+        job = await asyncio.to_thread(job_queue.wait, job_id, wait)
+    else:
+        job = await asyncio.to_thread(job_queue.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events: status - смена статуса, result/error - итог задания"""
+    events = job_queue.events(job_id)
+
+    async def generate():
+        # Ожидание идёт в потоке, цикл событий не блокируется
+        while (item := await asyncio.to_thread(next, events, None)) is not None:
+            event, payload = item
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 @router.get("/model-status")
 async def get_model_status():
     """Получение статуса модели"""
-    from ml.api.server import llm_model
-    
-    status = "available" if llm_model and llm_model.model_available else "unavailable"
+    status = "available" if await llm_model.is_available() else "unavailable"
     
     return {
         "model_status": status,
-        "model_name": getattr(llm_model, 'model_name', 'unknown') if llm_model else 'unknown',
+        "model_name": llm_model.model_name,
+        "single_flight": llm_model.single_flight.get_stats(),
+        "jobs": await asyncio.to_thread(job_queue.get_stats),
+        "ollama": llm_model.client.get_stats(),
+        "admission": llm_model.admission.get_stats(),
         "timestamp": datetime.now().isoformat()
     }
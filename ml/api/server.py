@@ -1,4 +1,6 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+from itertools import chain
+import json
 import os
 import sys
 
@@ -6,22 +8,43 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from utils import env, ollama
 from models.baseline import BaselineModel
-from api.vector_db.vector_store import VectorStore
+from models.admission import Overloaded
+from api.vector_db.registry import StoreRegistry
+from api.vector_db.federated import FederatedSearch
+from api.jobs import JobQueue, model_handlers
 
 app = Flask(__name__)
-model = BaselineModel(env.GENERATING_MODEL)
-vector_stores = {}
+vector_stores = StoreRegistry()
+model = BaselineModel(env.GENERATING_MODEL, stores=vector_stores)
+federated_search = FederatedSearch(vector_stores)
+jobs = JobQueue(model_handlers(model))
+
+@app.before_request
+def _start_jobs():
+    # Потоки заданий запускаются в процессе, который обслуживает запросы:
+    # при импорте их запустил бы и родительский процесс перезагрузчика Werkzeug
+    jobs.start()
 
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy", "model": model.model_name})
 
+def _bypass_cache():
+    """Ответ без кэша LLM: заголовок Cache-Control: no-cache или ?no_cache=1."""
+    return 'no-cache' in request.headers.get('Cache-Control', '') or request.args.get('no_cache') in ('1', 'true')
+
+def _overloaded(e):
+    """Отказ в допуске к модели: 429 или 503 с Retry-After, без ожидания генерации."""
+    return jsonify({"error": str(e)}), e.status, {"Retry-After": str(e.retry_after)}
+
 @app.route('/generate/entry-test', methods=['POST'])
 def generate_entry_test():
     try:
         data = request.json
-        result = model.generate_entry_test(data)
+        result = model.generate_entry_test(data, bypass_cache=_bypass_cache())
         return jsonify(result)
+    except Overloaded as e:
+        return _overloaded(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -29,8 +52,10 @@ def generate_entry_test():
 def generate_course_graph():
     try:
         data = request.json
-        result = model.generate_course_graph(data)
+        result = model.generate_course_graph(data, bypass_cache=_bypass_cache())
         return jsonify(result)
+    except Overloaded as e:
+        return _overloaded(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -39,31 +64,177 @@ def generate_lesson_plan():
     try:
         data = request.json
         lesson_type = data.get('type', 'theory')
-        result = model.generate_lesson_plan(data, lesson_type)
+        result = model.generate_lesson_plan(data, lesson_type, bypass_cache=_bypass_cache())
         return jsonify(result)
+    except Overloaded as e:
+        return _overloaded(e)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/generate/lesson-plan/stream', methods=['POST'])
+def stream_lesson_plan():
+    """Server-sent events: chunk - очередной кусок текста модели, retry - новая попытка, result/error - итог."""
+    try:
+        data = request.json
+        lesson_type = data.get('type', 'theory')
+        events = model.stream_lesson_plan(data, lesson_type, bypass_cache=_bypass_cache())
+    except Exception as e:
+        # Тело запроса, тип урока или данные для промпта некорректны: поток не начинается
+        return jsonify({"error": str(e)}), 400
+    # Первое событие берётся до ответа: отказ в допуске - обычный 429/503, а не событие потока
+    try:
+        first = next(events)
+    except Overloaded as e:
+        return _overloaded(e)
+    except Exception as e:
+        first, events = ("error", str(e)), iter(())
+
+    def generate():
+        try:
+            for event, payload in chain([first], events):
+                yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps(str(e), ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 @app.route('/evaluate/lesson-results', methods=['POST'])
 def evaluate_lesson_results():
     try:
         data = request.json
-        result = model.evaluate_lesson_results(data)
+        result = model.evaluate_lesson_results(data, bypass_cache=_bypass_cache())
         return jsonify(result)
+    except Overloaded as e:
+        return _overloaded(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/llm-cache/stats', methods=['GET'])
+def llm_cache_stats():
+    return jsonify(model.cache.get_stats())
+
+@app.route('/generate/stats', methods=['GET'])
+def generate_stats():
+    return jsonify({
+        "single_flight": model.single_flight.get_stats(),
+        "parser": model.get_parse_stats(),
+        "ollama": model.client.get_stats(),
+        "admission": model.admission.get_stats()
+    })
+
+@app.route('/jobs/<kind>', methods=['POST'])
+def submit_job(kind):
+    """Генерация в фоне: kind - entry-test, course-graph, lesson-plan или lesson-results, тело как у синхронного эндпоинта."""
+    if kind not in jobs.handlers:
+        return jsonify({"error": f"Unknown job type: {kind}"}), 404
+    job_id = jobs.submit(kind, request.json, _bypass_cache())
+    return jsonify({"job_id": job_id, "status": "queued"}), 202, {"Location": f"/jobs/{job_id}"}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Состояние задания; с ?wait=N ответ ждёт завершения до N секунд (long-poll)."""
+    try:
+        wait = min(float(request.args.get('wait', 0)), env.JOB_WAIT_TIMEOUT)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+    job = jobs.wait(job_id, wait) if wait > 0 else jobs.store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events: status - смена статуса, result/error - итог задания."""
+    def generate():
+        for event, payload in jobs.events(job_id):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/jobs/stats', methods=['GET'])
+def job_stats():
+    return jsonify(jobs.get_stats())
+
 @app.route('/vector-db/upload', methods=['POST'])
 def upload_to_vector_db():
     try:
         course_id = request.json.get('course_id')
         text = request.json.get('text')
         
-        if course_id not in vector_stores:
-            vector_stores[course_id] = VectorStore(course_id)
-        
-        vector_stores[course_id].add_document(text)
-        return jsonify({"status": "success", "course_id": course_id})
+        with vector_stores.writing(course_id, request.json.get('backend')) as store:
+            source_id = store.add_document(text)
+        return jsonify({"status": "success", "course_id": course_id, "id": source_id})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _batch_items(documents):
+    for document in documents:
+        if isinstance(document, str):
+            item = {"text": document}
+        elif isinstance(document, dict) and isinstance(document.get('text'), str):
+            item = {"text": document['text'], "metadata": document.get('metadata')}
+        else:
+            raise ValueError("document must be a string or an object with a text field")
+        if not item['text'].strip():
+            raise ValueError("document text is empty")
+        yield item
+
+def _ndjson_items(stream):
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+@app.route('/vector-db/upload-batch', methods=['POST'])
+def upload_batch_to_vector_db():
+    try:
+        # NDJSON читается из потока порциями, тело запроса целиком в память не попадает
+        if request.mimetype == 'application/x-ndjson':
+            course_id = request.args.get('course_id')
+            backend = request.args.get('backend')
+            items = _batch_items(_ndjson_items(request.stream))
+        else:
+            course_id = request.json.get('course_id')
+            backend = request.json.get('backend')
+            items = _batch_items(request.json.get('documents', []))
+
+        source_ids, chunk, pending, error = [], [], 0, None
+        with vector_stores.writing(course_id, backend) as store:
+            def add(chunk):
+                nonlocal pending
+                source_ids.extend(store.add_documents(chunk, persist=False))
+                pending += sum(len(item['text']) for item in chunk)
+                # Хвост сбрасывается в сегмент по мере загрузки, а не держится в памяти до конца
+                if pending >= env.VECTOR_DB_UPLOAD_FLUSH_MB * 1024 * 1024:
+                    store.persist()
+                    pending = 0
+
+            try:
+                for item in items:
+                    chunk.append(item)
+                    if len(chunk) == 500:
+                        add(chunk)
+                        chunk = []
+            except ValueError as e:
+                # Некорректная строка NDJSON или документ без текста: принятое до неё сохраняется
+                error = e
+            add(chunk)
+
+        if error is not None:
+            position = len(source_ids)
+            return jsonify({
+                "error": f"Document {position}: {error}",
+                "course_id": course_id,
+                "ids": source_ids,
+                "failed_at": position
+            }), 400
+        return jsonify({"status": "success", "course_id": course_id, "ids": source_ids})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -74,16 +245,52 @@ def search_vector_db():
         query = request.json.get('query')
         k = request.json.get('k', 3)
         
-        if course_id not in vector_stores:
+        store = vector_stores.get(course_id)
+        if store is None:
+            return jsonify({"error": "Vector store not found"}), 404
+        
+        results = store.search(query, k)
+        return jsonify({"results": results})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/vector-db/search-batch', methods=['POST'])
+def search_batch_vector_db():
+    try:
+        course_id = request.json.get('course_id')
+        queries = request.json.get('queries', [])
+        k = request.json.get('k', 3)
+        
+        store = vector_stores.get(course_id)
+        if store is None:
             return jsonify({"error": "Vector store not found"}), 404
         
-        results = vector_stores[course_id].search(query, k)
+        results = store.search_batch(queries, k)
         return jsonify({"results": results})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/vector-db/search-federated', methods=['POST'])
+def search_federated_vector_db():
+    try:
+        course_ids = request.json.get('course_ids', [])
+        query = request.json.get('query')
+        k = request.json.get('k', 3)
+        timeout = request.json.get('timeout')
+
+        result = federated_search.search(course_ids, query, k, timeout)
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/vector-db/stats', methods=['GET'])
+def vector_db_stats():
+    return jsonify(vector_stores.get_stats())
+
 if __name__ == '__main__':
-    if ollama.pull_model(env.GENERATING_MODEL):
+    # Сервис стартует, если модель удалось загрузить хотя бы на один сервер
+    failed = [url for url in env.OLLAMA_URLS if ollama.pull_model(env.GENERATING_MODEL, url)]
+    if len(failed) == len(env.OLLAMA_URLS):
         quit(1)
 
     app.run(host='0.0.0.0', port=env.PORT, debug=True)
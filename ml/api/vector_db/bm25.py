@@ -0,0 +1,163 @@
+import threading
+import numpy as np
+from api.vector_db.index import TfidfIndex, top_k
+
+
+class Bm25Index(TfidfIndex):
+    """
+    BM25 поверх того же хранилища частот, что и TfidfIndex.
+
+    Для каждого блока строится инвертированный индекс (CSC: термин ->
+    отсортированные номера документов и частоты). Запрос обрабатывается
+    по терминам в порядке убывания верхней оценки вклада (MaxScore):
+    когда сумма оценок оставшихся терминов меньше текущего k-го результата,
+    новые кандидаты больше не добавляются, а оставшиеся термины только
+    досчитываются для уже найденных документов бинарным поиском в их
+    списках. Поэтому время запроса зависит от числа совпавших записей
+    в списках, а не от размера курса.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        super().__init__()
+        self.k1 = k1
+        self.b = b
+        # Кэш общий у индекса и его снимков (copy.copy разделяет и блокировку):
+        # снимки считают веса параллельно, поэтому кэш меняется только под ней
+        self._postings = {}
+        self._postings_lock = threading.Lock()
+
+    def _block_postings(self, block):
+        # Блоки неизменяемы, их инвертированные списки кэшируются навсегда
+        with self._postings_lock:
+            cached = self._postings.get(id(block))
+        if cached is None or cached[0] is not block:
+            cached = (block, block.tocsc(), np.asarray(block.sum(axis=1)).ravel())
+            with self._postings_lock:
+                self._postings[id(block)] = cached
+        return cached[1:]
+
+    def _compute_weights(self):
+        # Списки блоков, которых нет в этом снимке, выбрасываются; если они ещё
+        # нужны более старому снимку, он просто построит их заново
+        live = {id(block) for block in self.blocks}
+        with self._postings_lock:
+            for key in [key for key in self._postings if key not in live]:
+                del self._postings[key]
+
+        postings, lengths, offsets = [], [], [0]
+        for block in self.blocks:
+            csc, doc_lengths = self._block_postings(block)
+            postings.append(csc)
+            lengths.append(doc_lengths)
+            offsets.append(offsets[-1] + block.shape[0])
+        tail = self.tail()
+        postings.append(tail.tocsc())
+        lengths.append(np.asarray(tail.sum(axis=1)).ravel())
+
+        doc_lengths = np.concatenate(lengths)
+        n = self.n_docs
+        df = self.df
+        idf = np.log(1 + (n - df + 0.5) / (df + 0.5))
+        return {
+            'idf': idf,
+            'postings': postings,
+            'offsets': np.asarray(offsets),
+            'doc_lengths': doc_lengths,
+            'avg_length': doc_lengths.mean() if n else 0.0
+        }
+
+    def _weights_memory(self):
+        if self._weights is None:
+            return 0
+        weights = self._weights
+        usage = weights['idf'].nbytes + weights['doc_lengths'].nbytes
+        return usage + sum(csc.data.nbytes + csc.indices.nbytes + csc.indptr.nbytes for csc in weights['postings'])
+
+    def _posting_list(self, weights, term_id):
+        doc_ids, frequencies = [], []
+        for csc, offset in zip(weights['postings'], weights['offsets']):
+            if term_id >= csc.shape[1]:
+                continue
+            start, end = csc.indptr[term_id], csc.indptr[term_id + 1]
+            doc_ids.append(csc.indices[start:end].astype(np.int64) + offset)
+            frequencies.append(csc.data[start:end])
+        if not doc_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        return np.concatenate(doc_ids), np.concatenate(frequencies)
+
+    def _lookup(self, weights, term_id, candidates):
+        """Частоты термина у кандидатов бинарным поиском, без копирования списков."""
+        found = np.zeros(len(candidates), dtype=bool)
+        frequencies = []
+        for csc, start_doc, end_doc in zip(weights['postings'], weights['offsets'], weights['offsets'][1:].tolist() + [self.n_docs]):
+            if term_id >= csc.shape[1]:
+                continue
+            start, end = csc.indptr[term_id], csc.indptr[term_id + 1]
+            low, high = np.searchsorted(candidates, [start_doc, end_doc])
+            if start == end or low == high:
+                continue
+            doc_ids = csc.indices[start:end]
+            local = candidates[low:high] - start_doc
+            positions = np.minimum(np.searchsorted(doc_ids, local), end - start - 1)
+            hits = doc_ids[positions] == local
+            found[low:high] = hits
+            frequencies.append(csc.data[start:end][positions[hits]])
+        return found, np.concatenate(frequencies) if frequencies else np.zeros(0)
+
+    def _term_scores(self, weights, term_id, doc_ids, frequencies, query_frequency):
+        norm = self.k1 * (1 - self.b + self.b * weights['doc_lengths'][doc_ids] / weights['avg_length'])
+        return query_frequency * weights['idf'][term_id] * frequencies * (self.k1 + 1) / (frequencies + norm)
+
+    def _bounds(self, weights, counts):
+        # Верхняя оценка вклада термина: предел BM25 при tf -> бесконечность
+        return {
+            term_id: counts[term_id] * weights['idf'][term_id] * (self.k1 + 1)
+            for term_id in counts if self.df[term_id] > 0
+        }
+
+    def score_bound(self, query):
+        """Максимально возможная оценка запроса - делитель для сравнения с другими курсами."""
+        if not self.n_docs:
+            return 1.0
+        bounds = self._bounds(self.weights(), self._term_counts(query))
+        return sum(bounds.values()) or 1.0
+
+    def _search_one(self, weights, query, k):
+        counts = self._term_counts(query)
+        bounds = self._bounds(weights, counts)
+        terms = list(bounds)
+        if not terms or k <= 0:
+            return []
+
+        terms.sort(key=bounds.get, reverse=True)
+        remaining = sum(bounds.values())
+
+        candidates = np.zeros(0, dtype=np.int64)
+        scores = np.zeros(0)
+        threshold = 0.0
+
+        for term_id in terms:
+            remaining -= bounds[term_id]
+
+            if len(candidates) >= k and remaining + bounds[term_id] < threshold:
+                # Неосновной термин: новые документы в топ уже не попадут
+                alive = scores + remaining + bounds[term_id] >= threshold
+                candidates, scores = candidates[alive], scores[alive]
+                found, frequencies = self._lookup(weights, term_id, candidates)
+                scores[found] += self._term_scores(weights, term_id, candidates[found], frequencies, counts[term_id])
+            else:
+                doc_ids, frequencies = self._posting_list(weights, term_id)
+                term_scores = self._term_scores(weights, term_id, doc_ids, frequencies, counts[term_id])
+                candidates, inverse = np.unique(np.concatenate([candidates, doc_ids]), return_inverse=True)
+                scores = np.bincount(inverse, weights=np.concatenate([scores, term_scores]), minlength=len(candidates))
+
+            if len(scores) >= k:
+                threshold = scores[top_k(scores, k)[-1]]
+
+        return [(int(candidates[i]), float(scores[i])) for i in top_k(scores, k)]
+
+    def search_batch(self, queries, k):
+        if not self.n_docs:
+            return [[] for _ in queries]
+        weights = self.weights()
+        return [self._search_one(weights, query, k) for query in queries]
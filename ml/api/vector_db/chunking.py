@@ -0,0 +1,84 @@
+import re
+from utils import env
+
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+WHITESPACE = re.compile(r'\s+')
+
+
+def _strip(text, start, end):
+    """Сужает (start, end) так, чтобы по краям не было пробельных символов."""
+    piece = text[start:end]
+    return start + len(piece) - len(piece.lstrip()), start + len(piece.rstrip())
+
+
+def _spans(text, pattern, start, end):
+    """
+    Делит text[start:end] по разделителю pattern, возвращает непустые
+    (start, end) без пробельных символов по краям.
+    """
+    spans = []
+    position = start
+    for match in pattern.finditer(text, start, end):
+        if text[position:match.start()].strip():
+            spans.append(_strip(text, position, match.start()))
+        position = match.end()
+    if text[position:end].strip():
+        spans.append(_strip(text, position, end))
+    return spans
+
+
+def _units(text, max_chars):
+    """
+    Абзацы; длинные абзацы - предложения; длинные предложения - куски по
+    словам; слова длиннее max_chars - куски по max_chars символов.
+    """
+    units = []
+    for paragraph in _spans(text, PARAGRAPH_BREAK, 0, len(text)):
+        if paragraph[1] - paragraph[0] <= max_chars:
+            units.append(paragraph)
+            continue
+        for sentence in _spans(text, SENTENCE_END, *paragraph):
+            if sentence[1] - sentence[0] <= max_chars:
+                units.append(sentence)
+                continue
+            # Кусок заканчивается на конце последнего слова, а не на пробелах после него
+            piece_start = piece_end = sentence[0]
+            for word_start, word_end in _spans(text, WHITESPACE, *sentence):
+                for start in range(word_start, word_end, max_chars):
+                    end = min(start + max_chars, word_end)
+                    if end - piece_start > max_chars and piece_end > piece_start:
+                        units.append((piece_start, piece_end))
+                        piece_start = start
+                    piece_end = end
+            units.append((piece_start, piece_end))
+    return units
+
+
+def chunk_text(text, max_chars=None, overlap=None):
+    """
+    Разбивает текст на пассажи не длиннее max_chars символов по границам
+    абзацев и предложений. Соседние пассажи перекрываются последними
+    единицами предыдущего пассажа общей длиной не больше overlap.
+
+    Возвращает [{"text", "start", "end"}], где start/end - смещения в text.
+    """
+    max_chars = max_chars or env.CHUNK_SIZE
+    overlap = env.CHUNK_OVERLAP if overlap is None else overlap
+
+    chunks = []
+    current = []
+    for unit in _units(text, max_chars):
+        if current and unit[1] - current[0][0] > max_chars:
+            chunks.append((current[0][0], current[-1][1]))
+            kept = []
+            for previous in reversed(current):
+                if unit[1] - previous[0] > max_chars or current[-1][1] - previous[0] > overlap:
+                    break
+                kept.insert(0, previous)
+            current = kept
+        current.append(unit)
+    if current:
+        chunks.append((current[0][0], current[-1][1]))
+
+    return [{"text": text[start:end], "start": start, "end": end} for start, end in chunks]
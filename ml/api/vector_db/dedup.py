@@ -0,0 +1,128 @@
+import re
+import bisect
+import xxhash
+import numpy as np
+from utils import env
+
+WORD = re.compile(r'\w+')
+SHINGLE_SIZE = 3
+# Хеш шинглов; отпечатки с другим хешем несравнимы, поэтому имя входит в файл отпечатков сегмента
+SHINGLE_HASH = "xxh3"
+
+
+def _hash(shingle):
+    return xxhash.xxh3_64_intdigest(shingle)
+
+
+def simhash(text):
+    """64-битный SimHash по шинглам из трёх слов: близкие тексты различаются в немногих битах."""
+    words = WORD.findall(text.lower())
+    shingles = [' '.join(words[i:i + SHINGLE_SIZE]) for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))]
+
+    hashes = np.asarray([_hash(shingle) for shingle in shingles], dtype=np.uint64)
+    bits = np.arange(64, dtype=np.uint64)
+    # Бит отпечатка - 1, если у большинства шинглов этот бит хеша равен 1
+    ones = ((hashes[:, None] >> bits) & np.uint64(1)).sum(axis=0)
+    return int(np.sum((2 * ones > len(shingles)).astype(np.uint64) << bits))
+
+
+class Deduplicator:
+    """
+    Поиск почти-дубликатов по SimHash среди проиндексированных пассажей курса.
+
+    64 бита отпечатка делятся на max_distance + 1 полос: у отпечатков,
+    различающихся не больше чем в max_distance битах, хотя бы одна полоса
+    совпадает (принцип Дирихле), так что кандидаты ищутся по словарям полос,
+    а расстояние Хэмминга проверяется только у них. Словари строятся при
+    первой проверке - поиску они не нужны.
+
+    duplicates: id документа -> кортеж ссылок на источники его дубликатов.
+    """
+
+    def __init__(self, max_distance=None):
+        self.max_distance = env.VECTOR_DB_DEDUP_DISTANCE if max_distance is None else max_distance
+        self.enabled = self.max_distance >= 0
+        n_bands = max(self.max_distance, 0) + 1
+        widths = [64 // n_bands + (i < 64 % n_bands) for i in range(n_bands)]
+        self._bands = [(int(shift), (1 << width) - 1) for shift, width in zip(np.cumsum([0] + widths[:-1]), widths)]
+        self._blocks = []
+        self._n_fingerprints = 0
+        self._tail = []
+        self._tables = None
+        self.duplicates = {}
+        self.n_duplicates = 0
+
+    def __len__(self):
+        return self._n_fingerprints + len(self._tail)
+
+    def attach(self, fingerprints, flushed=False):
+        """
+        Добавляет отпечатки сегмента (по порядку id документов).
+
+        flushed=True - сегмент записан из хвоста, его отпечатки уже учтены.
+        """
+        start = self._n_fingerprints
+        self._blocks.append((start, fingerprints))
+        self._n_fingerprints += len(fingerprints)
+        if flushed:
+            self._tail = self._tail[len(fingerprints):]
+        elif self._tables is not None:
+            for offset, value in enumerate(np.asarray(fingerprints).tolist()):
+                self._insert(start + offset, value)
+
+    def add(self, fingerprint):
+        if self._tables is not None:
+            self._insert(len(self), fingerprint)
+        self._tail.append(fingerprint)
+
+    def flush(self):
+        return np.asarray(self._tail, dtype=np.uint64)
+
+    def replace_blocks(self, count, fingerprints):
+        """После слияния сегментов: id документов не меняются, меняются только массивы."""
+        self._blocks[:count] = [(0, fingerprints)]
+
+    def _build_tables(self):
+        self._tables = [{} for _ in self._bands]
+        for start, fingerprints in self._blocks:
+            for offset, value in enumerate(np.asarray(fingerprints).tolist()):
+                self._insert(start + offset, value)
+        for offset, value in enumerate(self._tail):
+            self._insert(self._n_fingerprints + offset, value)
+
+    def _insert(self, doc_id, fingerprint):
+        for table, (shift, mask) in zip(self._tables, self._bands):
+            table.setdefault((fingerprint >> shift) & mask, []).append(doc_id)
+
+    def _fingerprint(self, doc_id):
+        if doc_id >= self._n_fingerprints:
+            return self._tail[doc_id - self._n_fingerprints]
+        block = bisect.bisect_right(self._blocks, doc_id, key=lambda block: block[0]) - 1
+        start, fingerprints = self._blocks[block]
+        return int(fingerprints[doc_id - start])
+
+    def find(self, fingerprint):
+        """id ранее проиндексированного почти-дубликата или None."""
+        if not self.enabled:
+            return None
+        if self._tables is None:
+            self._build_tables()
+
+        for table, (shift, mask) in zip(self._tables, self._bands):
+            for doc_id in table.get((fingerprint >> shift) & mask, ()):
+                if bin(self._fingerprint(doc_id) ^ fingerprint).count('1') <= self.max_distance:
+                    return doc_id
+        return None
+
+    def add_duplicate(self, doc_id, reference):
+        # Кортежи не меняются на месте, поэтому снимку хватает копии словаря
+        self.duplicates[doc_id] = self.duplicates.get(doc_id, ()) + (reference,)
+        self.n_duplicates += 1
+
+    def get_stats(self, n_documents):
+        total = n_documents + self.n_duplicates
+        return {
+            "documents": n_documents,
+            "duplicates": self.n_duplicates,
+            "dedup_ratio": self.n_duplicates / total if total else 0.0
+        }
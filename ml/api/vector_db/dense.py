@@ -0,0 +1,298 @@
+import copy
+import hashlib
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from utils import env
+from api.vector_db.index import GrowableArray, top_k
+
+_encoder = None
+
+
+class HashingEncoder:
+    """
+    Заглушка энкодера без модели: хэшированный мешок слов со знаками.
+
+    Детерминирована и не требует сети, поэтому подходит для офлайн-проверок
+    плотного бэкенда (EMBEDDING_MODEL=hashing).
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.analyzer = TfidfVectorizer().build_analyzer()
+
+    def encode(self, texts):
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for term in self.analyzer(text):
+                digest = int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+                embeddings[row, digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        return _normalize(embeddings)
+
+
+class SentenceTransformerEncoder:
+    """Локально сохранённая модель sentence-transformers на CPU."""
+
+    def __init__(self, model_path, batch_size=32):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_path, device='cpu', local_files_only=True)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+
+    def encode(self, texts):
+        embeddings = self.model.encode(
+            list(texts),
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+
+def get_encoder():
+    """Энкодер один на процесс: модель загружается при первом обращении."""
+    global _encoder
+    if _encoder is None:
+        if env.EMBEDDING_MODEL == "hashing":
+            _encoder = HashingEncoder()
+        else:
+            _encoder = SentenceTransformerEncoder(env.EMBEDDING_MODEL, env.EMBEDDING_BATCH_SIZE)
+    return _encoder
+
+
+def _normalize(embeddings):
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return embeddings / norms
+
+
+class DenseIndex:
+    """
+    Плотный индекс эмбеддингов float32.
+
+    Эмбеддинги нормализованы, поэтому косинусная близость считается одним
+    матричным умножением. Пока документов меньше ivf_min_docs, поиск точный
+    (перебор), дальше строится IVF: сферический k-means на n_lists кластеров,
+    запрос сравнивается только с документами n_probe ближайших кластеров.
+    Больше n_probe - выше recall и медленнее поиск.
+
+    IVF обучается только при слиянии сегментов (merge(), в фоновом потоке
+    compact() вне блокировки записи), когда корпус дорос до ivf_min_docs или
+    вырос вдвое с прошлого обучения. Центроиды и номера кластеров строк
+    хранятся в слитом сегменте, последующие сегменты хранят кластеры своих
+    строк, поэтому загрузка курса восстанавливает IVF без k-means.
+    """
+
+    def __init__(self, encoder=None, n_lists=None, n_probe=None, ivf_min_docs=None):
+        self.encoder = encoder or get_encoder()
+        self.dim = self.encoder.dim
+        self.n_lists = n_lists or env.DENSE_IVF_LISTS
+        self.n_probe = n_probe or env.DENSE_IVF_PROBE
+        self.ivf_min_docs = ivf_min_docs if ivf_min_docs is not None else env.DENSE_IVF_MIN_DOCS
+        self.blocks = []
+        self._ivf = None
+        self._reset_tail()
+
+    def _reset_tail(self):
+        self.tail_data = GrowableArray(np.float32, capacity=64 * self.dim)
+        # Кластеры строк хвоста: записываются в сегмент вместе с эмбеддингами
+        self.tail_clusters = GrowableArray(np.int32)
+
+    def tail(self):
+        return self.tail_data.view().reshape(-1, self.dim)
+
+    @property
+    def n_docs(self):
+        return sum(len(block) for block in self.blocks) + len(self.tail_data) // self.dim
+
+    def embeddings(self):
+        return self.blocks + [self.tail()]
+
+    def add(self, texts):
+        texts = list(texts)
+        if not texts:
+            return
+        start = self.n_docs
+        embeddings = self.encoder.encode(texts)
+        self.tail_data.extend(embeddings.ravel())
+        if self._ivf is not None:
+            clusters = _nearest(embeddings, self._ivf['centroids'])
+            self._extend_lists(clusters, start)
+            self.tail_clusters.extend(clusters)
+
+    def needs_training(self):
+        """IVF пора (пере)обучить: корпус дорос до ivf_min_docs или вдвое перерос прошлое обучение."""
+        n_docs = self.n_docs
+        return n_docs >= self.ivf_min_docs and (self._ivf is None or n_docs > 2 * self._ivf['trained_docs'])
+
+    def attach(self, segment, flushed=False):
+        start = self.n_docs
+        self.blocks.append(segment.arrays['embeddings'])
+        if flushed:
+            return
+        if 'ivf_centroids' in segment.arrays:
+            self._adopt(segment.arrays, start)
+        elif self._ivf is not None:
+            self._extend_lists(self._clusters(segment.arrays), start)
+
+    def flush(self):
+        arrays = {'embeddings': self.tail().copy()}
+        if self._ivf is not None:
+            arrays['ivf_clusters'] = self.tail_clusters.view().copy()
+            arrays['ivf_model'] = np.array([self._ivf['model']], dtype=np.int64)
+        self._reset_tail()
+        return arrays, []
+
+    def merge(self, segments):
+        embeddings = np.concatenate([segment.arrays['embeddings'] for segment in segments])
+        arrays = {'embeddings': embeddings}
+        if len(embeddings) < self.ivf_min_docs:
+            return arrays
+
+        first = segments[0].arrays
+        if 'ivf_centroids' in first and len(embeddings) <= 2 * int(first['ivf_trained'][0]):
+            # Модель первого сегмента ещё годится: кластеры строк переносятся без обучения
+            model = {
+                'centroids': np.asarray(first['ivf_centroids']),
+                'model': int(first['ivf_model'][0]),
+                'trained_docs': int(first['ivf_trained'][0])
+            }
+            clusters = np.concatenate([self._clusters(segment.arrays, model) for segment in segments])
+        else:
+            centroids = _kmeans(embeddings, min(self.n_lists, len(embeddings)))
+            model = {
+                'centroids': centroids,
+                'model': int(np.random.default_rng().integers(1, 2 ** 62)),
+                'trained_docs': len(embeddings)
+            }
+            clusters = _nearest(embeddings, centroids)
+
+        arrays['ivf_centroids'] = model['centroids']
+        arrays['ivf_clusters'] = clusters.astype(np.int32)
+        arrays['ivf_model'] = np.array([model['model']], dtype=np.int64)
+        arrays['ivf_trained'] = np.array([model['trained_docs']], dtype=np.int64)
+        return arrays
+
+    def replace_blocks(self, count, merged):
+        # Глобальные номера документов не меняются: та же модель IVF остаётся валидной
+        self.blocks[:count] = [merged.arrays['embeddings']]
+        if 'ivf_centroids' in merged.arrays and (
+            self._ivf is None or self._ivf['model'] != int(merged.arrays['ivf_model'][0])
+        ):
+            self._adopt(merged.arrays, 0)
+
+    def snapshot(self):
+        snapshot = copy.copy(self)
+        snapshot.blocks = list(self.blocks)
+        snapshot.tail_data = self.tail_data.frozen()
+        snapshot.tail_clusters = self.tail_clusters.frozen()
+        if self._ivf is not None:
+            snapshot._ivf = {**self._ivf, 'lists': [ids.frozen() for ids in self._ivf['lists']]}
+        return snapshot
+
+    def memory_usage(self):
+        """Оценка памяти процесса в байтах; блоки из mmap-сегментов не учитываются."""
+        usage = self.tail_data.nbytes + self.tail_clusters.nbytes
+        if self._ivf is not None:
+            usage += sum(ids.nbytes for ids in self._ivf['lists'])
+        return usage
+
+    def _rows(self, ids):
+        rows = np.empty((len(ids), self.dim), dtype=np.float32)
+        offset = 0
+        for block in self.embeddings():
+            mask = (ids >= offset) & (ids < offset + len(block))
+            rows[mask] = block[ids[mask] - offset]
+            offset += len(block)
+        return rows
+
+    def _clusters(self, arrays, model=None):
+        """Кластеры строк сегмента: сохранённые, если они той же модели, иначе ближайшие центроиды."""
+        model = model or self._ivf
+        if 'ivf_model' in arrays and int(arrays['ivf_model'][0]) == model['model']:
+            return np.asarray(arrays['ivf_clusters'])
+        return _nearest(arrays['embeddings'], model['centroids'])
+
+    def _adopt(self, arrays, start):
+        """
+        Берёт модель IVF из сегмента, начинающегося со строки start: списки
+        строятся по сохранённым кластерам, остальные строки (другие блоки и
+        хвост) распределяются по её центроидам.
+        """
+        centroids = np.asarray(arrays['ivf_centroids'])
+        self._ivf = {
+            'centroids': centroids,
+            'lists': [GrowableArray(np.int64, capacity=16) for _ in range(len(centroids))],
+            'model': int(arrays['ivf_model'][0]),
+            'trained_docs': int(arrays['ivf_trained'][0])
+        }
+        clusters = np.asarray(arrays['ivf_clusters'])
+        self._extend_lists(clusters, start)
+
+        offset = 0
+        for block in self.blocks:
+            if offset != start:
+                self._extend_lists(_nearest(block, centroids), offset)
+            offset += len(block)
+        tail = self.tail()
+        self.tail_clusters = GrowableArray(np.int32)
+        if len(tail):
+            tail_clusters = _nearest(tail, centroids)
+            self._extend_lists(tail_clusters, offset)
+            self.tail_clusters.extend(tail_clusters)
+
+    def _extend_lists(self, clusters, start):
+        order = np.argsort(clusters, kind='stable')
+        bounds = np.searchsorted(clusters[order], np.arange(len(self._ivf['lists']) + 1))
+        for cluster in np.flatnonzero(np.diff(bounds)):
+            self._ivf['lists'][cluster].extend(start + order[bounds[cluster]:bounds[cluster + 1]])
+
+    def score_bound(self, query):
+        # Косинусная близость уже лежит в [0, 1]
+        return 1.0
+
+    def search(self, query, k):
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries, k):
+        if not self.n_docs or not queries:
+            return [[] for _ in queries]
+
+        query_embeddings = self.encoder.encode(list(queries))
+
+        if self._ivf is None:
+            similarities = np.vstack([block @ query_embeddings.T for block in self.embeddings()]).T
+            return [
+                [(int(idx), float(scores[idx])) for idx in top_k(scores, k)]
+                for scores in similarities
+            ]
+
+        centroid_scores = query_embeddings @ self._ivf['centroids'].T
+        results = []
+        for query_embedding, scores in zip(query_embeddings, centroid_scores):
+            probe = top_k(scores, self.n_probe)
+            candidates = np.concatenate([self._ivf['lists'][cluster].view() for cluster in probe])
+            similarities = self._rows(candidates) @ query_embedding
+            results.append([(int(candidates[i]), float(similarities[i])) for i in top_k(similarities, k)])
+        return results
+
+
+def _kmeans(data, n_lists, iterations=10):
+    """Сферический k-means: центроиды нормализованы, близость - скалярное произведение."""
+    rng = np.random.default_rng(0)
+    centroids = data[rng.choice(len(data), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        empty = ~sums.any(axis=1)
+        sums[empty] = centroids[empty]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def _nearest(data, centroids, batch_size=65536):
+    return np.concatenate([
+        np.argmax(data[start:start + batch_size] @ centroids.T, axis=1)
+        for start in range(0, len(data), batch_size)
+    ])
@@ -0,0 +1,68 @@
+import heapq
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from utils import env
+
+
+class FederatedSearch:
+    """
+    Поиск одним запросом по нескольким курсам.
+
+    Курсы опрашиваются параллельно в пуле потоков. Оценки каждого курса
+    делятся на максимально возможную оценку запроса в этом курсе (для
+    косинусных бэкендов это 1, для BM25 - сумма верхних оценок терминов),
+    после чего отсортированные списки курсов сливаются кучей в общий топ-k.
+    Курсы, не успевшие ответить к сроку, возвращаются в timed_out;
+    их загрузка продолжается в пуле и пригодится следующим запросам.
+    """
+
+    def __init__(self, registry, max_workers=None):
+        self.registry = registry
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or env.VECTOR_DB_FEDERATED_WORKERS,
+            thread_name_prefix="federated-search"
+        )
+
+    def _search_course(self, course_id, query, k):
+        store = self.registry.get(course_id)
+        if store is None:
+            return None
+
+        bound = store.score_bound(query)
+        return [
+            {"course_id": course_id, "score": result["similarity"] / bound, **result}
+            for result in store.search(query, k)
+        ]
+
+    def search(self, course_ids, query, k=3, timeout=None):
+        timeout = env.VECTOR_DB_FEDERATED_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        futures = {
+            self.executor.submit(self._search_course, course_id, query, k): course_id
+            for course_id in dict.fromkeys(course_ids)
+        }
+        _, pending = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+
+        per_course, missing, timed_out, failed = [], [], [], {}
+        for future, course_id in futures.items():
+            if future in pending:
+                timed_out.append(course_id)
+                continue
+            try:
+                results = future.result()
+            except Exception as e:
+                failed[course_id] = str(e)
+                continue
+            if results is None:
+                missing.append(course_id)
+            else:
+                per_course.append(results)
+
+        merged = heapq.merge(*per_course, key=lambda result: result["score"], reverse=True)
+        return {
+            "results": [result for result, _ in zip(merged, range(k))],
+            "timed_out": timed_out,
+            "missing": missing,
+            "failed": failed
+        }
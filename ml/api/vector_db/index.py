@@ -0,0 +1,331 @@
+import copy
+import threading
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfVectorizer
+from api.vector_db.terms import TERMS
+
+
+class GrowableArray:
+    """Одномерный numpy-буфер с амортизированным O(1) добавлением в конец."""
+
+    def __init__(self, dtype, capacity=1024):
+        self._data = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._data.dtype)
+        end = self._size + len(values)
+        if end > len(self._data):
+            capacity = max(end, 2 * len(self._data))
+            grown = np.empty(capacity, dtype=self._data.dtype)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:end] = values
+        self._size = end
+
+    def view(self):
+        return self._data[:self._size]
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
+    def frozen(self):
+        """
+        Неизменяемое представление текущего содержимого без копирования буфера:
+        последующие extend пишут за его границу или в новый буфер.
+        """
+        return copy.copy(self)
+
+
+class TfidfIndex:
+    """
+    Инкрементальный TF-IDF индекс.
+
+    Словарь терминов курса только дополняется и хранит не строки, а
+    глобальные id из общего для всех курсов TermDictionary: локальный id
+    термина - позиция в term_ids, обратный поиск - searchsorted по
+    отсортированной копии. Строки документов хранятся как сырые частоты:
+    неизменяемые блоки (сегменты с диска) плюс хвост в CSR-буферах, куда
+    пишутся новые документы. Document frequency
+    обновляется при каждом добавлении, а веса IDF и нормы строк
+    пересчитываются лениво перед поиском, поэтому добавление документа
+    стоит O(длина документа), а не переобучение векторизатора на всём
+    корпусе.
+
+    Токенизация и формула весов совпадают с TfidfVectorizer по умолчанию
+    (smooth_idf, l2-нормализация), так что косинусная близость совпадает
+    с полным переобучением с точностью до 1e-9.
+
+    Поиск выполняется только на снимках (snapshot()): запись меняет индекс,
+    но не трогает данные, которые видит уже опубликованный снимок. Веса
+    снимка считаются при его первом поиске, а не при публикации, поэтому
+    запись не платит O(размер индекса) за каждый добавленный документ.
+    """
+
+    dictionary = TERMS
+
+    def __init__(self):
+        self.analyzer = TfidfVectorizer().build_analyzer()
+        self.term_ids = GrowableArray(np.int32)
+        self.n_terms = 0
+        self._sorted_ids = np.zeros(0, dtype=np.int32)
+        self._sorted_local = np.zeros(0, dtype=np.int32)
+        self.df = np.zeros(0, dtype=np.int64)
+        self.blocks = []
+        self.flushed_terms = 0
+        self._reset_tail()
+        self._weights = None
+        self._weights_lock = threading.Lock()
+
+    def _reset_tail(self):
+        self.indptr = GrowableArray(np.int32)
+        self.indptr.extend([0])
+        self.indices = GrowableArray(np.int32)
+        self.data = GrowableArray(np.float64)
+
+    @property
+    def n_docs(self):
+        return sum(block.shape[0] for block in self.blocks) + len(self.indptr) - 1
+
+    def _local_ids(self, global_ids):
+        """Локальные id по глобальным, -1 для терминов, которых нет в курсе."""
+        if not len(self._sorted_ids):
+            return np.full(len(global_ids), -1, dtype=np.int32)
+        positions = np.minimum(np.searchsorted(self._sorted_ids, global_ids), len(self._sorted_ids) - 1)
+        return np.where(self._sorted_ids[positions] == global_ids, self._sorted_local[positions], -1)
+
+    def _add_terms(self, global_ids):
+        """
+        Добавляет термины, которых ещё нет в курсе. Новые id вливаются в
+        отсортированную копию вставкой: O(V + k log k), а не сортировка
+        всего словаря курса при каждом добавлении.
+        """
+        order = np.argsort(global_ids, kind='stable')
+        added = np.asarray(global_ids, dtype=np.int32)[order]
+        positions = np.searchsorted(self._sorted_ids, added)
+        # Отсортированные массивы заменяются, а не меняются на месте: их держат снимки
+        self._sorted_ids = np.insert(self._sorted_ids, positions, added)
+        self._sorted_local = np.insert(self._sorted_local, positions, (self.n_terms + order).astype(np.int32))
+        self.term_ids.extend(global_ids)
+        self.n_terms = len(self.term_ids)
+
+    def _term_counts(self, text):
+        """Частоты терминов запроса по локальным id; термины, которых нет в курсе, пропускаются."""
+        local_ids = self._local_ids(self.dictionary.lookup(self.analyzer(text)))
+        term_ids, counts = np.unique(local_ids[local_ids >= 0], return_counts=True)
+        return dict(zip(term_ids.tolist(), counts.tolist()))
+
+    def add(self, texts):
+        start = len(self.indices)
+        documents = [self.analyzer(text) for text in texts]
+        global_ids = self.dictionary.intern([term for terms in documents for term in terms])
+
+        local_ids = self._local_ids(global_ids)
+        new_ids = global_ids[local_ids < 0]
+        if len(new_ids):
+            # Новые термины получают локальные id в порядке первого появления
+            unique, first = np.unique(new_ids, return_index=True)
+            self._add_terms(unique[np.argsort(first)])
+            local_ids = self._local_ids(global_ids)
+
+        bounds = np.cumsum([0] + [len(terms) for terms in documents])
+        for begin, end in zip(bounds[:-1], bounds[1:]):
+            term_ids, counts = np.unique(local_ids[begin:end], return_counts=True)
+            self.indices.extend(term_ids)
+            self.data.extend(counts)
+            self.indptr.extend([len(self.indices)])
+
+        # df не меняется на месте: опубликованные снимки держат старый массив
+        df = np.bincount(self.indices.view()[start:], minlength=self.n_terms)
+        df[:len(self.df)] += self.df
+        self.df = df
+        self._weights = None
+
+    def attach(self, segment, flushed=False):
+        """
+        Добавляет неизменяемый блок строк из сегмента, открытого через mmap.
+
+        flushed=True - сегмент только что записан из хвоста этого индекса,
+        его термины и df уже учтены.
+        """
+        if not flushed:
+            self._add_terms(self.dictionary.intern(segment.terms))
+            self.df = segment.arrays['df']
+            self.flushed_terms = self.n_terms
+        self.blocks.append(_segment_matrix(segment))
+        self._weights = None
+
+    def tail(self):
+        return csr_matrix(
+            (self.data.view(), self.indices.view(), self.indptr.view()),
+            shape=(len(self.indptr) - 1, self.n_terms)
+        )
+
+    def flush(self):
+        """Отдаёт массивы хвоста и новые термины для записи сегмента; хвост очищается."""
+        arrays = _csr_arrays(self.tail())
+        arrays['df'] = self.df
+        terms = self.dictionary.terms(self.term_ids.view()[self.flushed_terms:self.n_terms].tolist())
+        self._reset_tail()
+        self.flushed_terms = self.n_terms
+        return arrays, terms
+
+    def merge(self, segments):
+        matrices = [_segment_matrix(segment) for segment in segments]
+        indptr = [np.zeros(1, dtype=np.int64)]
+        offset = 0
+        for matrix in matrices:
+            indptr.append(np.asarray(matrix.indptr[1:], dtype=np.int64) + offset)
+            offset += matrix.nnz
+        arrays = _csr_arrays(csr_matrix(
+            (
+                np.concatenate([matrix.data for matrix in matrices]),
+                np.concatenate([matrix.indices for matrix in matrices]),
+                np.concatenate(indptr)
+            ),
+            shape=(sum(matrix.shape[0] for matrix in matrices), matrices[-1].shape[1])
+        ))
+        arrays['df'] = segments[-1].arrays['df']
+        return arrays
+
+    def replace_blocks(self, count, merged):
+        self.blocks[:count] = [_segment_matrix(merged)]
+        self._weights = None
+
+    def needs_training(self):
+        """Лексическому индексу обучать нечего; плотный так просит внеочередное слияние."""
+        return False
+
+    def snapshot(self):
+        """Снимок для чтения: разделяет с индексом буферы, но не видит дальнейших записей."""
+        snapshot = copy.copy(self)
+        snapshot.blocks = list(self.blocks)
+        snapshot.term_ids = self.term_ids.frozen()
+        snapshot.indptr = self.indptr.frozen()
+        snapshot.indices = self.indices.frozen()
+        snapshot.data = self.data.frozen()
+        snapshot._weights = None
+        snapshot._weights_lock = threading.Lock()
+        return snapshot
+
+    def memory_usage(self):
+        """
+        Оценка памяти процесса в байтах; блоки из mmap-сегментов и общий
+        словарь терминов не учитываются.
+        """
+        usage = self.term_ids.nbytes + self._sorted_ids.nbytes + self._sorted_local.nbytes + self.df.nbytes
+        usage += self.indptr.nbytes + self.indices.nbytes + self.data.nbytes
+        return usage + self._weights_memory()
+
+    def _weights_memory(self):
+        return sum(array.nbytes for array in self._weights) if self._weights is not None else 0
+
+    def idf(self):
+        n = self.n_docs
+        return np.log((1 + n) / (1 + self.df)) + 1
+
+    def matrices(self):
+        return self.blocks + [self.tail()]
+
+    def weights(self):
+        """Веса для поиска; считаются один раз на снимок, одновременные поиски ждут первый."""
+        if self._weights is None:
+            with self._weights_lock:
+                if self._weights is None:
+                    self._weights = self._compute_weights()
+        return self._weights
+
+    def _compute_weights(self):
+        idf = self.idf()
+        norms = []
+        for counts in self.matrices():
+            squared = csr_matrix(
+                ((counts.data * idf[counts.indices]) ** 2, counts.indices, counts.indptr),
+                shape=counts.shape
+            )
+            norms.append(np.sqrt(np.asarray(squared.sum(axis=1)).ravel()))
+        return idf, np.concatenate(norms)
+
+    def _query_matrix(self, queries, idf):
+        rows, cols, values, query_norms = [0], [], [], []
+        for query in queries:
+            counts = self._term_counts(query)
+            term_ids = np.fromiter(counts, dtype=np.int64, count=len(counts))
+            query_weights = np.array([counts[t] for t in term_ids], dtype=np.float64) * idf[term_ids]
+            query_norms.append(np.linalg.norm(query_weights))
+            # q·d = Σ q_t * idf_t * count_dt, веса документа не материализуются
+            cols.append(term_ids)
+            values.append(query_weights * idf[term_ids])
+            rows.append(rows[-1] + len(term_ids))
+        matrix = csr_matrix(
+            (np.concatenate(values), np.concatenate(cols), np.asarray(rows)),
+            shape=(len(queries), self.n_terms)
+        )
+        return matrix, np.asarray(query_norms)
+
+    def similarities_batch(self, queries):
+        """Косинусная близость всех запросов ко всем документам, матрица (запросы x документы)."""
+        if not self.n_docs or not queries:
+            return np.zeros((len(queries), self.n_docs))
+
+        idf, norms = self.weights()
+        query_matrix, query_norms = self._query_matrix(queries, idf)
+        dots = np.hstack([
+            (query_matrix[:, :counts.shape[1]] @ counts.T).toarray()
+            for counts in self.matrices()
+        ])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarities = dots / np.outer(query_norms, norms)
+        return np.nan_to_num(similarities, nan=0.0, posinf=0.0)
+
+    def similarities(self, query):
+        return self.similarities_batch([query])[0]
+
+    def score_bound(self, query):
+        # Косинусная близость уже лежит в [0, 1]
+        return 1.0
+
+    def search(self, query, k):
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries, k):
+        return [
+            [(int(idx), float(similarities[idx])) for idx in top_k(similarities, k)]
+            for similarities in self.similarities_batch(queries)
+        ]
+
+
+def top_k(scores, k):
+    """Индексы k наибольших значений по убыванию: argpartition за O(n) и сортировка только k."""
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def _csr_arrays(matrix):
+    # Одинаковый тип индексов нужен, чтобы scipy не копировал mmap-массивы
+    index_dtype = np.int32 if matrix.nnz < np.iinfo(np.int32).max else np.int64
+    return {
+        'indptr': np.asarray(matrix.indptr, dtype=index_dtype),
+        'indices': np.asarray(matrix.indices, dtype=index_dtype),
+        'data': np.asarray(matrix.data, dtype=np.float64)
+    }
+
+
+def _segment_matrix(segment):
+    arrays = segment.arrays
+    return csr_matrix(
+        (arrays['data'], arrays['indices'], arrays['indptr']),
+        shape=(len(arrays['indptr']) - 1, len(arrays['df'])),
+        copy=False
+    )
@@ -0,0 +1,63 @@
+import time
+import threading
+from collections import OrderedDict
+from utils import env
+
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+
+class QueryCache:
+    """
+    LRU-кэш результатов поиска с TTL.
+
+    Ключ включает поколение хранилища курса: любое добавление документов
+    меняет поколение, и старые записи курса перестают находиться, а затем
+    вытесняются по LRU или TTL.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries or env.VECTOR_DB_QUERY_CACHE_SIZE
+        self.ttl = ttl or env.VECTOR_DB_QUERY_CACHE_TTL
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0}
+
+    @staticmethod
+    def key(course_id, generation, query, k):
+        return (course_id, generation, normalize_query(query), k)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+
+            expires, results = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return results
+
+    def put(self, key, results):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0
+            }
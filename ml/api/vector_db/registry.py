@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from utils import env
+from api.vector_db.vector_store import VectorStore
+from api.vector_db.query_cache import QueryCache
+from api.vector_db.terms import TERMS
+
+
+class StoreRegistry:
+    """
+    Векторные хранилища курсов, загружаемые по первому обращению.
+
+    Хранилища держатся в LRU-порядке; когда их суммарная оценка памяти
+    превышает memory_budget, самые давно использованные выгружаются
+    (кроме последнего, занятых записью и закреплённых через writing()).
+    """
+
+    def __init__(self, memory_budget=None, base_path=None, cache=None):
+        self.memory_budget = memory_budget or env.VECTOR_DB_MEMORY_BUDGET_MB * 1024 * 1024
+        self.base_path = base_path
+        self.cache = cache or QueryCache()
+        self._stores = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+        # Число открытых блоков writing() по курсам: такие хранилища не выгружаются
+        self._pins = Counter()
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0}
+
+    def get(self, course_id, create=False, backend=None, pin=False):
+        """
+        Возвращает хранилище курса или None, если его нет ни в памяти, ни на
+        диске. pin=True - хранилище закрепляется до вызова unpin().
+        """
+        with self._lock:
+            store = self._stores.get(course_id)
+            if store is not None:
+                self._stores.move_to_end(course_id)
+                self.stats["hits"] += 1
+                if pin:
+                    self._pins[course_id] += 1
+                return store
+
+            self.stats["misses"] += 1
+            loading = self._loading.setdefault(course_id, threading.Lock())
+
+        # Курс загружается без общей блокировки, чтобы медленная загрузка
+        # одного курса не задерживала обращения к остальным
+        with loading:
+            with self._lock:
+                store = self._stores.get(course_id)
+                if store is not None and pin:
+                    self._pins[course_id] += 1
+            if store is not None:
+                return store
+
+            if not create and not VectorStore.exists(course_id, self.base_path):
+                with self._lock:
+                    self._loading.pop(course_id, None)
+                return None
+            store = VectorStore(course_id, base_path=self.base_path, backend=backend, cache=self.cache)
+
+            with self._lock:
+                self.stats["loads"] += 1
+                self._stores[course_id] = store
+                self._loading.pop(course_id, None)
+                if pin:
+                    self._pins[course_id] += 1
+                self._evict()
+            return store
+
+    def unpin(self, course_id):
+        with self._lock:
+            self._pins[course_id] -= 1
+            if self._pins[course_id] <= 0:
+                del self._pins[course_id]
+            self._evict()
+
+    @contextmanager
+    def writing(self, course_id, backend=None):
+        """
+        Хранилище курса (создаётся при необходимости) для записи: закреплено
+        от выгрузки на весь блок, запись идёт в VectorStore.writing(). Иначе
+        между get и записью хранилище с пустым хвостом могло бы быть
+        выгружено, и следующий get создал бы второе для того же курса.
+        """
+        store = self.get(course_id, create=True, backend=backend, pin=True)
+        try:
+            with store.writing():
+                yield store
+        finally:
+            # Бюджет пересчитывается уже с записанными документами
+            self.unpin(course_id)
+
+    def memory_usage(self):
+        return sum(store.memory_usage() for store in self._stores.values())
+
+    def _evict(self):
+        # Общий словарь терминов в бюджет не входит: выгрузка курсов его не уменьшит
+        usage = self.memory_usage()
+        for course_id in list(self._stores)[:-1]:
+            if usage <= self.memory_budget:
+                break
+            store = self._stores[course_id]
+            if self._pins[course_id] or store.is_busy():
+                continue
+            usage -= store.memory_usage()
+            del self._stores[course_id]
+            self.stats["evictions"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                **self.stats,
+                "stores": len(self._stores),
+                "memory_usage": self.memory_usage(),
+                "memory_budget": self.memory_budget,
+                # Только курсы, загруженные сейчас: после выгрузки курс пропадает из списка
+                "loaded_courses": {course_id: store.get_stats() for course_id, store in self._stores.items()},
+                "query_cache": self.cache.get_stats(),
+                # memory_usage (с ним сравнивается бюджет) - только индексы курсов, memory_total - вместе с общим словарём
+                "terms": TERMS.get_stats(),
+                "memory_total": self.memory_usage() + TERMS.memory_usage()
+            }
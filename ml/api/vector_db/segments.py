@@ -0,0 +1,282 @@
+import os
+import json
+import mmap
+import uuid
+import fcntl
+import shutil
+import threading
+from contextlib import contextmanager
+import numpy as np
+from api.vector_db.dedup import simhash, SHINGLE_HASH
+
+MANIFEST = "manifest.json"
+LOCK = ".lock"
+FINGERPRINTS = f"fingerprints.{SHINGLE_HASH}.npy"
+# fingerprints.npy - отпечатки со старым хешем шинглов (blake2b), больше не читаются
+DOCUMENT_ARRAYS = {"doc_offsets.npy", "fingerprints.npy", FINGERPRINTS}
+
+
+class DocumentSegment:
+    """
+    Документы сегмента: JSON-строки в documents.jsonl и смещения в doc_offsets.npy.
+
+    FINGERPRINTS - SimHash каждого документа, duplicates.jsonl - ссылки
+    на источники почти-дубликатов, свёрнутых в документы курса.
+    """
+
+    def __init__(self, path):
+        self.offsets = np.load(os.path.join(path, "doc_offsets.npy"), mmap_mode='r')
+        with open(os.path.join(path, "documents.jsonl"), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        fingerprints_path = os.path.join(path, FINGERPRINTS)
+        if os.path.exists(fingerprints_path):
+            self.fingerprints = np.load(fingerprints_path, mmap_mode='r')
+        else:
+            # Сегменты, записанные до дедупликации или с другим хешем шинглов:
+            # отпечатки считаются один раз и сохраняются рядом (сегмент при этом не меняется)
+            self.fingerprints = np.asarray([simhash(self[i]['text']) for i in range(len(self))], dtype=np.uint64)
+            tmp_path = f"{fingerprints_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, self.fingerprints)
+            os.replace(tmp_path, fingerprints_path)
+
+        self.duplicates = []
+        duplicates_path = os.path.join(path, "duplicates.jsonl")
+        if os.path.exists(duplicates_path):
+            with open(duplicates_path, 'r', encoding='utf-8') as f:
+                self.duplicates = [json.loads(line) for line in f if line.strip()]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return json.loads(self._buffer[start:end])
+
+
+class Segment:
+    """Неизменяемый сегмент индекса: массивы индекса открываются через mmap."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.arrays = {}
+        for file_name in os.listdir(path):
+            if file_name.endswith(".npy") and file_name not in DOCUMENT_ARRAYS:
+                self.arrays[file_name[:-4]] = np.load(os.path.join(path, file_name), mmap_mode='r')
+        self.documents = DocumentSegment(path)
+
+    @property
+    def terms(self):
+        # Читаются только при загрузке индекса и слиянии: в памяти строки держит общий словарь терминов
+        with open(os.path.join(self.path, "terms.txt"), 'r', encoding='utf-8') as f:
+            return f.read().split('\n') if os.path.getsize(f.name) else []
+
+
+def write_segment(path, arrays, terms, documents, fingerprints, duplicates=()):
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+
+    with open(os.path.join(tmp_path, "terms.txt"), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(terms))
+
+    offsets = [0]
+    with open(os.path.join(tmp_path, "documents.jsonl"), 'wb') as f:
+        for document in documents:
+            line = json.dumps(document, ensure_ascii=False).encode('utf-8') + b'\n'
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.save(os.path.join(tmp_path, "doc_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(tmp_path, FINGERPRINTS), np.asarray(fingerprints, dtype=np.uint64))
+
+    with open(os.path.join(tmp_path, "duplicates.jsonl"), 'w', encoding='utf-8') as f:
+        for duplicate in duplicates:
+            f.write(json.dumps(duplicate, ensure_ascii=False) + '\n')
+
+    os.replace(tmp_path, path)
+    return Segment(path)
+
+
+class SegmentStorage:
+    """
+    Append-only хранилище сегментов курса.
+
+    manifest.json перечисляет активные сегменты и переписывается атомарно
+    (через os.replace), поэтому читатель всегда видит согласованный набор.
+    Сегменты после записи не меняются, фоновое слияние заменяет префикс
+    списка одним сегментом (write_merged + replace).
+
+    В каталог курса могут писать несколько процессов (воркеры gunicorn/
+    uvicorn): выбор имени сегмента, его запись и обновление манифеста идут
+    под файловой блокировкой (locked()), а манифест перед изменением
+    перечитывается с диска. Слитые сегменты не удаляются сразу - их ещё
+    может открывать другой процесс по прежнему манифесту, - а попадают в
+    obsolete манифеста и удаляются при следующем слиянии.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = os.path.join(path, MANIFEST)
+        self.manifest = {
+            "version": 1, "generation": 0, "next_segment": 1, "backend": None, "segments": [], "obsolete": []
+        }
+        self.manifest_mtime = None
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._depth = 0
+
+    @contextmanager
+    def locked(self):
+        """
+        Исключительная блокировка каталога курса между процессами (flock) и
+        потоками; повторный вход из того же потока не блокируется.
+        """
+        with self._lock:
+            if not self._depth:
+                os.makedirs(self.path, exist_ok=True)
+                self._lock_file = open(os.path.join(self.path, LOCK), 'a')
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if not self._depth:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def changed(self, exact=False):
+        """
+        Изменил ли манифест другой процесс. По умолчанию - по времени
+        изменения файла, это дёшево для каждого поиска; exact=True - по
+        generation из самого файла, для проверки под блокировкой: время
+        изменения у двух быстрых записей может совпасть.
+        """
+        try:
+            if not exact:
+                return os.stat(self.manifest_path).st_mtime_ns != self.manifest_mtime
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)["generation"] != self.manifest["generation"]
+        except FileNotFoundError:
+            return False
+
+    def _read_manifest(self):
+        if not self.exists():
+            return
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+        self.manifest = {"obsolete": [], **manifest}
+
+    def open_segments(self):
+        self._read_manifest()
+        return [Segment(os.path.join(self.path, name)) for name in self.manifest["segments"]]
+
+    def _write_manifest(self):
+        self.manifest["generation"] += 1
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+        self.manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+
+    def append(self, arrays, terms, documents, fingerprints, duplicates=()):
+        with self.locked():
+            # Номер сегмента и список сегментов берутся из манифеста на диске, а не из памяти
+            self._read_manifest()
+            name = f"seg-{self.manifest['next_segment']:06d}"
+            self.manifest["next_segment"] += 1
+            segment = write_segment(os.path.join(self.path, name), arrays, terms, documents, fingerprints, duplicates)
+            self.manifest["segments"].append(segment.name)
+            self._write_manifest()
+        return segment
+
+    def write_merged(self, segments, arrays):
+        """
+        Пишет слияние сегментов в новый сегмент, манифест не трогает. Имя
+        уникально без блокировки, поэтому запись не задерживает добавления.
+        """
+        terms = [term for segment in segments for term in segment.terms]
+        documents = (segment.documents[i] for segment in segments for i in range(len(segment.documents)))
+        fingerprints = np.concatenate([segment.documents.fingerprints for segment in segments])
+        duplicates = [duplicate for segment in segments for duplicate in segment.documents.duplicates]
+        path = os.path.join(self.path, f"seg-merged-{uuid.uuid4().hex[:12]}")
+        return write_segment(path, arrays, terms, documents, fingerprints, duplicates)
+
+    def replace(self, old_segments, merged):
+        """
+        Заменяет префикс old_segments на merged в манифесте. Если манифест
+        тем временем изменило другое слияние, merged удаляется и
+        возвращается False. Сегменты, вытесненные прошлым слиянием,
+        удаляются, а old_segments становятся obsolete.
+        """
+        names = [segment.name for segment in old_segments]
+        with self.locked():
+            self._read_manifest()
+            if self.manifest["segments"][:len(names)] != names:
+                shutil.rmtree(merged.path, ignore_errors=True)
+                return False
+
+            # Уже открытые mmap остаются валидными после удаления файлов
+            for name in self.manifest["obsolete"]:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            self.manifest["obsolete"] = names
+            self.manifest["segments"] = [merged.name] + self.manifest["segments"][len(names):]
+            self._write_manifest()
+        return True
+
+
+class DocumentList:
+    """Список документов курса: сегменты на диске плюс ещё не записанный хвост."""
+
+    def __init__(self):
+        self.segments = []
+        self.tail = []
+        self._offsets = [0]
+
+    def __len__(self):
+        return self._offsets[-1] + len(self.tail)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i >= self._offsets[-1]:
+            return self.tail[i - self._offsets[-1]]
+        segment = int(np.searchsorted(self._offsets, i, side='right')) - 1
+        return self.segments[segment][i - self._offsets[segment]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, document):
+        self.tail.append(document)
+
+    def attach(self, documents):
+        """Переносит документы хвоста в сегмент (после его записи на диск)."""
+        self.segments.append(documents)
+        self._offsets.append(self._offsets[-1] + len(documents))
+        self.tail = self.tail[len(documents):]
+
+    def snapshot(self):
+        snapshot = DocumentList()
+        snapshot.segments = list(self.segments)
+        snapshot.tail = list(self.tail)
+        snapshot._offsets = list(self._offsets)
+        return snapshot
+
+    def replace_segments(self, count, merged):
+        self.segments[:count] = [merged]
+        self._offsets = [0]
+        for documents in self.segments:
+            self._offsets.append(self._offsets[-1] + len(documents))
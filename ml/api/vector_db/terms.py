@@ -0,0 +1,130 @@
+import sys
+import threading
+from collections import namedtuple
+import numpy as np
+import xxhash
+
+# Опубликованное состояние словаря: читатели берут его одной ссылкой
+_State = namedtuple("_State", ["slots", "hashes", "offsets", "size"])
+
+
+class TermDictionary:
+    """
+    Общий для всех курсов словарь терминов: термин <-> глобальный id.
+
+    Каждая строка хранится один раз на процесс, а индекс курса держит
+    только int32-массив глобальных id своих терминов. Строки лежат подряд
+    в одном буфере UTF-8 (границы - в массиве offsets), поиск id по
+    термину - открытая хеш-таблица с линейным пробированием на numpy-массивах
+    (id + 1 в ячейке, 128-битный xxh3 термина - в массиве hashes; совпадение
+    128-битного хеша считается совпадением термина), так что на термин
+    приходится несколько десятков байт без отдельных Python-объектов.
+
+    Id никогда не переиспользуются и словарь только растёт, поэтому чтение
+    идёт без блокировки по опубликованному состоянию, а добавление
+    сериализуется. Ячейки с id, которых ещё нет в состоянии читателя,
+    заняты позже его терминов и для него считаются пустыми.
+    """
+
+    def __init__(self, capacity=1024):
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._state = _State(
+            slots=np.zeros(2 * capacity, dtype=np.int32),
+            hashes=np.zeros((capacity, 2), dtype=np.uint64),
+            offsets=np.zeros(capacity + 1, dtype=np.int64),
+            size=0
+        )
+
+    def __len__(self):
+        return self._state.size
+
+    def lookup(self, terms):
+        """Глобальные id терминов, -1 для неизвестных."""
+        unique = list(dict.fromkeys(terms))
+        ids = dict(zip(unique, self._find(self._state, unique).tolist()))
+        return np.fromiter((ids[term] for term in terms), dtype=np.int32, count=len(terms))
+
+    def intern(self, terms):
+        """Глобальные id терминов; новые термины добавляются в словарь."""
+        unique = list(dict.fromkeys(terms))
+        ids = dict(zip(unique, self._find(self._state, unique).tolist()))
+        missing = [term for term, term_id in ids.items() if term_id < 0]
+        if missing:
+            with self._lock:
+                state = self._state
+                # Пока ждали блокировку, часть терминов мог добавить другой поток
+                for term, term_id in zip(missing, self._find(state, missing).tolist()):
+                    if term_id < 0:
+                        state, term_id = self._insert(state, term)
+                    ids[term] = term_id
+                self._state = state
+        return np.fromiter((ids[term] for term in terms), dtype=np.int32, count=len(terms))
+
+    def terms(self, term_ids):
+        offsets = self._state.offsets
+        buffer = self._buffer
+        return [buffer[offsets[term_id]:offsets[term_id + 1]].decode('utf-8') for term_id in term_ids]
+
+    @staticmethod
+    def _hashes(terms):
+        digests = b''.join(xxhash.xxh3_128_digest(term) for term in terms)
+        return np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+
+    def _find(self, state, terms):
+        hashes = self._hashes(terms)
+        mask = len(state.slots) - 1
+        positions = (hashes[:, 0] & np.uint64(mask)).astype(np.int64)
+        result = np.full(len(terms), -1, dtype=np.int64)
+        pending = np.arange(len(terms))
+        while len(pending):
+            candidates = state.slots[positions[pending]].astype(np.int64) - 1
+            live = (candidates >= 0) & (candidates < state.size)
+            hit = np.zeros(len(pending), dtype=bool)
+            hit[live] = (state.hashes[candidates[live]] == hashes[pending[live]]).all(axis=1)
+            result[pending[hit]] = candidates[hit]
+            pending = pending[live & ~hit]
+            positions[pending] = (positions[pending] + 1) & mask
+        return result
+
+    def _insert(self, state, term):
+        """Добавляет термин (под блокировкой); возвращает новое состояние и id."""
+        term_id = state.size
+        slots, hashes, offsets = state.slots, state.hashes, state.offsets
+        if term_id == len(hashes):
+            # Массивы заменяются, а не растут на месте: старые держат читатели
+            hashes = np.concatenate([hashes, np.zeros_like(hashes)])
+            offsets = np.concatenate([offsets, np.zeros(len(offsets) - 1, dtype=np.int64)])
+        if 2 * (term_id + 1) > len(slots):
+            slots = self._rehash(hashes[:term_id], 2 * len(slots))
+
+        self._buffer += term.encode('utf-8')
+        hashes[term_id] = self._hashes([term])[0]
+        offsets[term_id + 1] = len(self._buffer)
+        # Ячейка заполняется последней: читатель не увидит id раньше его хеша и границ
+        self._place(slots, hashes[term_id, 0], term_id)
+        return _State(slots, hashes, offsets, term_id + 1), term_id
+
+    def _rehash(self, hashes, size):
+        slots = np.zeros(size, dtype=np.int32)
+        for term_id, value in enumerate(hashes[:, 0].tolist()):
+            self._place(slots, value, term_id)
+        return slots
+
+    @staticmethod
+    def _place(slots, value, term_id):
+        mask = len(slots) - 1
+        position = int(value) & mask
+        while slots[position]:
+            position = (position + 1) & mask
+        slots[position] = term_id + 1
+
+    def memory_usage(self):
+        state = self._state
+        return sys.getsizeof(self._buffer) + state.slots.nbytes + state.hashes.nbytes + state.offsets.nbytes
+
+    def get_stats(self):
+        return {"terms": len(self), "memory_bytes": self.memory_usage()}
+
+
+TERMS = TermDictionary()
@@ -1,65 +1,305 @@
 import os
+import sys
 import json
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from utils import env
+from api.vector_db.index import TfidfIndex
+from api.vector_db.dense import DenseIndex
+from api.vector_db.bm25 import Bm25Index
+from api.vector_db.segments import SegmentStorage, DocumentList, MANIFEST
+from api.vector_db.chunking import chunk_text
+from api.vector_db.dedup import Deduplicator, simhash
+
+BACKENDS = {
+    "tfidf": TfidfIndex,
+    "bm25": Bm25Index,
+    "dense": DenseIndex
+}
+
+# Согласованное состояние для чтения: публикуется одной заменой ссылки
+Snapshot = namedtuple("Snapshot", ["index", "documents", "duplicates", "generation"])
 
 class VectorStore:
-    def __init__(self, course_id):
+    """
+    Векторное хранилище курса.
+
+    Запись идёт под блокировкой в рабочие index/documents, после чего
+    публикуется новый Snapshot. Поиск берёт текущий снимок без блокировок,
+    поэтому не ждёт загрузки документов и не видит наполовину обновлённый
+    индекс.
+
+    Почти-дубликаты уже проиндексированных пассажей не индексируются:
+    их источники добавляются к найденному пассажу как ссылки (duplicates).
+
+    Запись идёт внутри writing(): под файловой блокировкой каталога курса,
+    поэтому в один курс могут писать несколько процессов.
+    """
+
+    def __init__(self, course_id, base_path=None, backend=None, cache=None):
         self.course_id = course_id
-        self.vectorizer = TfidfVectorizer()
-        self.documents = []
-        self.vectors = None
+        self.path = os.path.join(base_path or env.VECTOR_DB_PATH, str(course_id))
+        self.storage = SegmentStorage(self.path)
+        self.backend = backend or env.VECTOR_DB_BACKEND
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._compaction = None
+        self._writing = 0
         self.load_data()
-    
+
+    @staticmethod
+    def exists(course_id, base_path=None):
+        path = os.path.join(base_path or env.VECTOR_DB_PATH, str(course_id))
+        return os.path.exists(os.path.join(path, MANIFEST)) or os.path.exists(os.path.join(path, "documents.json"))
+
+    @property
+    def generation(self):
+        """Меняется при любом изменении содержимого курса, в том числе другим процессом."""
+        return (self.storage.manifest["generation"], len(self.documents), self.dedup.n_duplicates)
+
+    def memory_usage(self):
+        return self._snapshot.index.memory_usage() + sum(sys.getsizeof(document['text']) for document in self.documents.tail)
+
+    def is_busy(self):
+        """Есть незаписанные документы или идёт запись - такой store нельзя выгружать."""
+        return bool(self.documents.tail or self._duplicates_tail) or self._lock.locked()
+
+    def _publish(self):
+        self._snapshot = Snapshot(
+            self.index.snapshot(), self.documents.snapshot(), dict(self.dedup.duplicates), self.generation
+        )
+
     def load_data(self):
-        data_path = f"ml/api/vector_db/{self.course_id}/documents.json"
+        self.documents = DocumentList()
+        self.dedup = Deduplicator()
+        self._duplicates_tail = []
+        self._last_duplicate_source = -1
+        self.segments = []
+
+        if self.storage.exists():
+            segments = self.storage.open_segments()
+            # Бэкенд существующего курса задаётся его манифестом
+            self.backend = self.storage.manifest.get("backend") or "tfidf"
+            self.index = BACKENDS[self.backend]()
+            for segment in segments:
+                self._attach(segment)
+            self._publish()
+            return
+
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown vector store backend: {self.backend}")
+        self.storage.manifest["backend"] = self.backend
+        self.index = BACKENDS[self.backend]()
+
+        # Миграция со старого формата documents.json
+        data_path = os.path.join(self.path, "documents.json")
         if os.path.exists(data_path):
             with open(data_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                self.documents = data.get('documents', [])
-                
-            if self.documents:
-                self.vectors = self.vectorizer.fit_transform([doc['text'] for doc in self.documents])
-    
+
+            for document in data.get('documents', []):
+                self.documents.append(document)
+                self.dedup.add(simhash(document['text']))
+                self.index.add([document['text']])
+            self.save_data()
+        self._publish()
+
+    def _attach(self, segment):
+        self.index.attach(segment)
+        self.documents.attach(segment.documents)
+        self.dedup.attach(segment.documents.fingerprints)
+        for duplicate in segment.documents.duplicates:
+            self.dedup.add_duplicate(duplicate['document'], self._reference(duplicate))
+            self._last_duplicate_source = duplicate['source']['id']
+        self.segments.append(segment)
+
+    @staticmethod
+    def _reference(duplicate):
+        return {"source": duplicate['source'], "metadata": duplicate['metadata']}
+
+    @contextmanager
+    def writing(self):
+        """
+        Блок записи в курс под файловой блокировкой его каталога. Перед
+        записью подхватываются сегменты, записанные другими процессами (id
+        документов и источников продолжают их), а при выходе хвост
+        записывается в сегмент - чужая запись не может оказаться между
+        добавлением документов и их сохранением. Вложенные блоки того же
+        потока работают внутри внешнего.
+        """
+        with self.storage.locked():
+            outer = not self._writing
+            if outer:
+                with self._lock:
+                    if self.storage.changed(exact=True):
+                        self.load_data()
+            self._writing += 1
+            try:
+                yield self
+            finally:
+                self._writing -= 1
+                if outer:
+                    self.persist()
+
+    def refresh(self):
+        """Перечитывает индекс, если манифест обновил другой процесс."""
+        # Если идёт запись, поиск не ждёт её и работает по текущему снимку
+        if self.storage.changed() and self._lock.acquire(blocking=False):
+            try:
+                self.load_data()
+            finally:
+                self._lock.release()
+
     def save_data(self):
-        os.makedirs(f"ml/api/vector_db/{self.course_id}", exist_ok=True)
-        data_path = f"ml/api/vector_db/{self.course_id}/documents.json"
-        
-        with open(data_path, 'w', encoding='utf-8') as f:
-            json.dump({"documents": self.documents}, f, ensure_ascii=False, indent=2)
-    
+        if not self.documents.tail and not self._duplicates_tail:
+            return
+
+        arrays, terms = self.index.flush()
+        segment = self.storage.append(
+            arrays, terms, self.documents.tail, self.dedup.flush(), self._duplicates_tail
+        )
+        # Хвост в памяти заменяется тем же сегментом, открытым через mmap
+        self.index.attach(segment, flushed=True)
+        self.documents.attach(segment.documents)
+        self.dedup.attach(segment.documents.fingerprints, flushed=True)
+        self._duplicates_tail = []
+        self.segments.append(segment)
+
+        # Слияние заодно обучает IVF плотного индекса - вне блокировки записи
+        if (len(self.segments) > env.VECTOR_DB_MAX_SEGMENTS or self.index.needs_training()) and self._compaction is None:
+            self._compaction = threading.Thread(target=self.compact, daemon=True)
+            self._compaction.start()
+
+    def compact(self):
+        """Сливает текущие сегменты в один; новые записи во время слияния не блокируются."""
+        try:
+            segments = list(self.segments)
+            if len(segments) < 2 and not (segments and self.index.needs_training()):
+                return
+
+            merged = self.storage.write_merged(segments, self.index.merge(segments))
+            with self.storage.locked(), self._lock:
+                # Под блокировкой хвост пуст: его записывает writing() перед выходом
+                stale = self.storage.changed(exact=True)
+                replaced = self.storage.replace(segments, merged)
+                if stale:
+                    # Другой процесс изменил курс: индекс перечитывается (уже со слиянием, если оно прошло)
+                    self.load_data()
+                    return
+                if not replaced:
+                    return
+                self.index.replace_blocks(len(segments), merged)
+                self.documents.replace_segments(len(segments), merged.documents)
+                self.dedup.replace_blocks(len(segments), merged.documents.fingerprints)
+                self.segments[:len(segments)] = [merged]
+                self._publish()
+        finally:
+            self._compaction = None
+
     def add_document(self, text, metadata=None):
-        doc_id = len(self.documents)
-        document = {
-            "id": doc_id,
-            "text": text,
-            "metadata": metadata or {}
-        }
-        self.documents.append(document)
-        
-        if len(self.documents) == 1:
-            self.vectors = self.vectorizer.fit_transform([text])
-        else:
-            self.vectors = self.vectorizer.fit_transform([doc['text'] for doc in self.documents])
-        
-        self.save_data()
-    
+        return self.add_documents([{"text": text, "metadata": metadata}])[0]
+
+    def _next_source_id(self):
+        # Источник, целиком состоящий из дубликатов, остаётся только в ссылках
+        next_id = self._last_duplicate_source + 1
+        if not len(self.documents):
+            return next_id
+        last = self.documents[-1]
+        # Документы старого формата без разбиения - сами себе источник
+        return max(last.get('source', {}).get('id', last['id']) + 1, next_id)
+
+    def add_documents(self, items, persist=True, chunk_size=None, chunk_overlap=None):
+        """
+        Режет тексты на пассажи и индексирует их за один проход и одну запись
+        сегмента. Пассаж, почти совпадающий с уже проиндексированным, не
+        индексируется, а добавляется ссылкой к нему. Возвращает id
+        источников - по одному на каждый элемент items.
+
+        persist=False - сегмент записывается не сразу, а при выходе из
+        внешнего блока writing() (или из этого вызова, если блока нет).
+        Пустой текст не дал бы ни одного пассажа, и id его источника нигде
+        не сохранился бы: такие items отклоняются ValueError до записи.
+        """
+        for position, item in enumerate(items):
+            if not isinstance(item.get('text'), str) or not item['text'].strip():
+                raise ValueError(f"Document {position} has no text")
+
+        with self.writing(), self._lock:
+            source_ids, texts = [], []
+            source_id = self._next_source_id()
+            for item in items:
+                for chunk in chunk_text(item['text'], chunk_size, chunk_overlap):
+                    document = {
+                        "id": len(self.documents),
+                        "text": chunk['text'],
+                        "metadata": item.get('metadata') or {},
+                        "source": {"id": source_id, "start": chunk['start'], "end": chunk['end']}
+                    }
+                    fingerprint = simhash(chunk['text'])
+                    original = self.dedup.find(fingerprint)
+                    if original is not None:
+                        duplicate = {"document": original, "source": document['source'], "metadata": document['metadata']}
+                        self.dedup.add_duplicate(original, self._reference(duplicate))
+                        self._duplicates_tail.append(duplicate)
+                        self._last_duplicate_source = source_id
+                        continue
+
+                    self.documents.append(document)
+                    self.dedup.add(fingerprint)
+                    texts.append(document['text'])
+                source_ids.append(source_id)
+                source_id += 1
+
+            self.index.add(texts)
+
+            if persist:
+                self.save_data()
+            self._publish()
+            return source_ids
+
+    def persist(self):
+        with self.storage.locked(), self._lock:
+            self.save_data()
+            self._publish()
+
+    def get_stats(self):
+        return self.dedup.get_stats(len(self.documents))
+
+    def score_bound(self, query):
+        """Делитель, приводящий оценки запроса к [0, 1] для сравнения между курсами."""
+        return self._snapshot.index.score_bound(query)
+
     def search(self, query, k=3):
-        if not self.documents:
-            return []
-        
-        query_vec = self.vectorizer.transform([query])
-        similarities = cosine_similarity(query_vec, self.vectors).flatten()
-        
-        top_indices = np.argsort(similarities)[-k:][::-1]
-        results = []
-        
-        for idx in top_indices:
-            if similarities[idx] > 0:
-                results.append({
-                    "document": self.documents[idx],
-                    "similarity": float(similarities[idx])
-                })
-        
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries, k=3):
+        """Ищет сразу по нескольким запросам одним матричным умножением."""
+        self.refresh()
+        snapshot = self._snapshot
+        if not len(snapshot.documents):
+            return [[] for _ in queries]
+
+        results = [None] * len(queries)
+        keys = [None] * len(queries)
+        if self.cache is not None:
+            for i, query in enumerate(queries):
+                keys[i] = self.cache.key(self.course_id, snapshot.generation, query, k)
+                results[i] = self.cache.get(keys[i])
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            hits_batch = snapshot.index.search_batch([queries[i] for i in missing], k)
+            for i, hits in zip(missing, hits_batch):
+                results[i] = [
+                    {
+                        "document": snapshot.documents[idx],
+                        "similarity": similarity,
+                        "duplicates": list(snapshot.duplicates.get(idx, ()))
+                    }
+                    for idx, similarity in hits if similarity > 0
+                ]
+                if self.cache is not None:
+                    self.cache.put(keys[i], results[i])
+
         return results
@@ -0,0 +1,87 @@
+"""
+Проверка допуска к модели с классами приоритета на заглушке Ollama.
+
+Поднимает HTTP-заглушку Ollama (см. ollama_pool_demo) и отправляет через
+BaselineModel всплеск из --batch запросов класса batch (как оценка
+результатов урока в конце занятия), а чуть позже - --interactive
+интерактивных запросов. Одновременно генерируют не больше --limit
+запросов, очередь каждого класса - --queue, срок интерактивного запроса -
+--deadline секунд.
+
+Ожидается: интерактивные запросы обгоняют очередь batch и укладываются в
+срок, лишние запросы batch сразу получают отказ 429 с Retry-After, а не
+ждут своей очереди до таймаута.
+
+Запуск из каталога ml:
+    python -m benchmarks.admission_demo --batch 30 --interactive 6
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from utils import env
+from models.baseline import BaselineModel
+from models.admission import AdmissionController, Overloaded, INTERACTIVE, BATCH
+from models.ollama_pool import OllamaPool
+from models.response_cache import ResponseCache
+from benchmarks.ollama_pool_demo import StubOllama
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", type=int, default=30)
+    parser.add_argument("--interactive", type=int, default=6)
+    parser.add_argument("--limit", type=int, default=2)
+    parser.add_argument("--queue", type=int, default=8)
+    parser.add_argument("--deadline", type=float, default=3.0, help="срок интерактивного запроса, с")
+    parser.add_argument("--latency", type=float, default=0.3, help="время ответа заглушки, с")
+    args = parser.parse_args()
+
+    stub = StubOllama("a", env.GENERATING_MODEL, latency=args.latency)
+    model = BaselineModel(env.GENERATING_MODEL, cache=ResponseCache(os.path.join(tempfile.mkdtemp(), "llm_cache.sqlite3")))
+    model.client.close()
+    model.client = OllamaPool([stub.url], probe_interval=0)
+    model.admission = AdmissionController(
+        limit=args.limit,
+        queue_limits={INTERACTIVE: args.queue, BATCH: args.queue},
+        timeouts={INTERACTIVE: args.deadline, BATCH: 600}
+    )
+
+    def one(priority, i):
+        if priority == INTERACTIVE:
+            # Интерактивные запросы приходят, когда очередь batch уже набрана
+            time.sleep(0.1)
+        started = time.monotonic()
+        try:
+            result = model.generate_response(f"{priority} {i}", max_retries=1, priority=priority)
+            outcome = "error" if "error" in result else "ok"
+        except Overloaded as e:
+            outcome = e.status
+        return priority, outcome, time.monotonic() - started
+
+    requests = [(BATCH, i) for i in range(args.batch)] + [(INTERACTIVE, i) for i in range(args.interactive)]
+    with ThreadPoolExecutor(len(requests)) as pool:
+        results = list(pool.map(lambda request: one(*request), requests))
+    stub.stop()
+
+    latencies = {}
+    for priority in (INTERACTIVE, BATCH):
+        outcomes = Counter(outcome for p, outcome, _ in results if p == priority)
+        latencies[priority] = [latency for p, outcome, latency in results if p == priority and outcome == "ok"]
+        median = statistics.median(latencies[priority]) if latencies[priority] else 0.0
+        print(
+            f"{priority}: успешно {outcomes['ok']}, 429 - {outcomes[429]}, 503 - {outcomes[503]}, "
+            f"ошибок {outcomes['error']}, медиана времени ответа {median:.2f} с"
+        )
+    print(f"Среднее время генерации по оценке допуска: {model.admission.get_stats()['service_time']:.2f} с")
+
+    if len(latencies[INTERACTIVE]) < args.interactive or max(latencies[INTERACTIVE]) > args.deadline:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
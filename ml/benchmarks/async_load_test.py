@@ -0,0 +1,116 @@
+"""
+Нагрузочная проверка async-эндпоинтов api/routes.py.
+
+Одновременно отправляет несколько запросов /generate-lesson и считает,
+сколько из них обрабатывались параллельно. Если обработчики блокируют цикл
+событий, запросы выполняются по одному и пиковая параллельность равна 1.
+
+По умолчанию приложение запускается в процессе, а Ollama заменяется
+заглушкой, которая отдаёт ответ потоком за --latency секунд. С --url
+запросы идут в уже запущенный сервер (с настоящей моделью).
+
+Запуск из каталога ml:
+    python -m benchmarks.async_load_test --requests 20 --latency 2
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import httpx
+from fastapi import FastAPI
+
+# PromptTemplates импортируется как ml.prompt_templates
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from api import routes
+from models.response_cache import ResponseCache
+from models.admission import AsyncAdmissionController
+
+
+class FakeAsyncClient:
+    """Заглушка ollama.AsyncClient: JSON-ответ кусками в течение latency секунд."""
+
+    def __init__(self, latency, chunks=20):
+        self.latency = latency
+        self.chunks = chunks
+
+    async def generate(self, model, prompt, options, stream, format=None, system=None, keep_alive=None):
+        text = json.dumps({"theory_section": {"title": "Урок", "content": "текст " * self.chunks}}, ensure_ascii=False)
+        size = len(text) // self.chunks + 1
+
+        async def parts():
+            for start in range(0, len(text), size):
+                await asyncio.sleep(self.latency / self.chunks)
+                yield {"response": text[start:start + size]}
+
+        return parts()
+
+    async def show(self, model):
+        return {}
+
+
+async def run(client, n_requests):
+    spans = []
+
+    async def one(i):
+        start = time.perf_counter()
+        response = await client.post("/generate-lesson", json={
+            "lesson_topic": f"Тема {i}",
+            "course_materials": "",
+            "interests": "музыка",
+            "student_level": "A2"
+        })
+        spans.append((start, time.perf_counter(), response.status_code))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n_requests)))
+    return spans, time.perf_counter() - started
+
+
+def peak_concurrency(spans):
+    events = sorted([(start, 1) for start, _, _ in spans] + [(end, -1) for _, end, _ in spans])
+    peak = current = 0
+    for _, delta in events:
+        current += delta
+        peak = max(peak, current)
+    return peak
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=2.0, help="время ответа заглушки модели, с")
+    parser.add_argument("--url", help="адрес запущенного сервера вместо приложения в процессе")
+    args = parser.parse_args()
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=None)
+    else:
+        app = FastAPI()
+        app.include_router(routes.router)
+        routes.llm_model.client = FakeAsyncClient(args.latency)
+        routes.llm_model.cache = ResponseCache(os.path.join(tempfile.mkdtemp(), "llm_cache.sqlite3"))
+        # Проверяется цикл событий, а не допуск: все запросы генерируют одновременно
+        routes.llm_model.admission = AsyncAdmissionController(limit=args.requests)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test", timeout=None)
+
+    async with client:
+        spans, elapsed = await run(client, args.requests)
+
+    latencies = sorted(end - start for start, end, _ in spans)
+    failed = sum(status != 200 for _, _, status in spans)
+    peak = peak_concurrency(spans)
+    print(f"Запросов: {args.requests}, ошибок: {failed}")
+    print(f"Общее время: {elapsed:.2f} с, сумма времён запросов: {sum(latencies):.2f} с")
+    print(f"Задержка p50: {latencies[len(latencies) // 2]:.2f} с, max: {latencies[-1]:.2f} с")
+    print(f"Пиковая параллельность: {peak}")
+
+    if failed or (args.requests > 1 and peak < 2):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
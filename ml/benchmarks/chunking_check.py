@@ -0,0 +1,87 @@
+"""
+Проверка разбиения текста на пассажи на случайных текстах.
+
+Генерирует --texts текстов из слов, предложений и абзацев со случайными
+пробелами, табуляциями и переводами строк (в том числе в начале и в конце
+текста, абзацев и предложений, а также слова длиннее max_chars) и
+режет их chunk_text с разными max_chars и overlap. Для каждого пассажа
+проверяется:
+    - len(text) <= max_chars;
+    - text совпадает с исходным текстом по смещениям start/end;
+    - по краям пассажа нет пробельных символов;
+и что пассажи покрывают все непробельные символы текста.
+
+Печатает число нарушений и первые примеры; при нарушениях код выхода 1.
+
+Запуск из каталога ml:
+    python -m benchmarks.chunking_check --texts 2000
+"""
+import sys
+import random
+import argparse
+from api.vector_db.chunking import chunk_text
+
+SPACES = [" ", "  ", "\t", "\n", " \n ", "\u00a0"]
+ENDS = [".", "!", "?", "…", ""]
+
+
+def make_word(rng, max_chars):
+    # Изредка - слово длиннее max_chars, которое придётся резать по символам
+    length = rng.randint(max_chars + 1, 3 * max_chars) if rng.random() < 0.02 else rng.randint(1, 15)
+    return "".join(rng.choice("абвгдежзиклмнопрстуabcdefxyz0123456789-") for _ in range(length))
+
+
+def make_text(rng, max_chars):
+    paragraphs = []
+    for _ in range(rng.randint(1, 6)):
+        sentences = []
+        for _ in range(rng.randint(1, 8)):
+            words = [make_word(rng, max_chars) for _ in range(rng.randint(1, 60))]
+            sentence = "".join(word + rng.choice(SPACES) for word in words).rstrip() + rng.choice(ENDS)
+            sentences.append(sentence + rng.choice(SPACES) * rng.randint(0, 3))
+        paragraphs.append(rng.choice(["", " ", "\t"]) + "".join(sentences))
+    separator = rng.choice(["\n\n", "\n \n", "\n\n\n", " \n\t\n "])
+    return rng.choice(["", " ", "\n"]) + separator.join(paragraphs) + rng.choice(["", " ", "  \n", "\t \n\n "])
+
+
+def check(text, max_chars, overlap):
+    problems = []
+    covered = [False] * len(text)
+    for chunk in chunk_text(text, max_chars, overlap):
+        if len(chunk['text']) > max_chars:
+            problems.append(f"длина {len(chunk['text'])} > {max_chars}")
+        if text[chunk['start']:chunk['end']] != chunk['text']:
+            problems.append(f"смещения {chunk['start']}:{chunk['end']} не совпадают с текстом")
+        if chunk['text'] != chunk['text'].strip():
+            problems.append(f"пробелы по краям: {chunk['text'][:20]!r}...{chunk['text'][-20:]!r}")
+        covered[chunk['start']:chunk['end']] = [True] * (chunk['end'] - chunk['start'])
+    lost = sum(1 for char, hit in zip(text, covered) if not hit and not char.isspace())
+    if lost:
+        problems.append(f"потеряно непробельных символов: {lost}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures = []
+    for i in range(args.texts):
+        max_chars = rng.choice([20, 50, 100, 300, 800])
+        overlap = rng.choice([0, max_chars // 4, max_chars // 2])
+        text = make_text(rng, max_chars)
+        for problem in check(text, max_chars, overlap):
+            failures.append((i, max_chars, overlap, problem))
+
+    print(f"Текстов: {args.texts}, нарушений: {len(failures)}")
+    for i, max_chars, overlap, problem in failures[:10]:
+        print(f"  текст {i} (max_chars={max_chars}, overlap={overlap}): {problem}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Проверка балансировки между несколькими серверами Ollama на заглушках.
+
+Поднимает три локальные HTTP-заглушки Ollama (/api/generate потоком, /api/ps,
+/api/show) - все без загруженной модели, как после pull_model; модель
+"загружается" первой генерацией. В список добавляется и адрес, где никто не
+слушает. Одновременно отправляет --requests генераций через BaselineModel,
+а посередине останавливает одну из заглушек.
+
+Ожидается: запросы, не помещающиеся на сервер с загруженной моделью,
+расходятся по остальным, так что отвечают все заглушки; запросы к
+остановленной заглушке уходят на другой сервер, а она сама и недоступный
+адрес исключаются после OLLAMA_MAX_FAILURES ошибок.
+
+Запуск из каталога ml:
+    python -m benchmarks.ollama_pool_demo --requests 40
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils import env
+from models.baseline import BaselineModel
+from models.ollama_pool import OllamaPool
+from models.admission import AdmissionController
+from models.response_cache import ResponseCache
+
+
+class StubOllama:
+    """
+    HTTP-заглушка сервера Ollama: ответ JSON-объектом кусками за latency
+    секунд; после первой генерации /api/ps показывает модель загруженной.
+    """
+
+    def __init__(self, name, model, loaded=False, latency=0.3):
+        self.name = name
+        self.requests = 0
+        self.loaded = loaded
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/api/ps':
+                    self._json({"models": [{"name": model, "model": model}] if stub.loaded else []})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path == '/api/show':
+                    self._json({"modelfile": "", "model_info": {}})
+                    return
+                if self.path != '/api/generate':
+                    self.send_error(404)
+                    return
+
+                stub.requests += 1
+                stub.loaded = True
+                text = json.dumps({"instance": stub.name, "prompt": request.get('prompt', '')})
+                parts = [text[i:i + 8] for i in range(0, len(text), 8)]
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                try:
+                    for part in parts:
+                        time.sleep(latency / len(parts))
+                        self.wfile.write((json.dumps({"model": model, "response": part, "done": False}) + "\n").encode('utf-8'))
+                        self.wfile.flush()
+                    self.wfile.write((json.dumps({"model": model, "response": "", "done": True}) + "\n").encode('utf-8'))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def free_url():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--parallel", type=int, default=2, help="OLLAMA_NUM_PARALLEL заглушки")
+    parser.add_argument("--latency", type=float, default=0.3, help="время ответа заглушки, с")
+    args = parser.parse_args()
+
+    stubs = [
+        StubOllama(name, env.GENERATING_MODEL, latency=args.latency) for name in ("a", "b", "c")
+    ]
+    down_url = free_url()
+
+    model = BaselineModel(env.GENERATING_MODEL, cache=ResponseCache(os.path.join(tempfile.mkdtemp(), "llm_cache.sqlite3")))
+    model.client.close()
+    model.client = OllamaPool(
+        [stub.url for stub in stubs] + [down_url], probe_interval=0.2, max_failures=2, num_parallel=args.parallel
+    )
+    model.admission = AdmissionController(limit=args.concurrency)
+    time.sleep(0.5)
+
+    def one(i):
+        if i == args.requests // 2:
+            stubs[0].stop()
+        return model.generate_response(f"запрос {i}", max_retries=2)
+
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    model.client.close()
+
+    served = Counter(result.get('instance', 'error') for result in results)
+    errors = served.pop('error', 0)
+    print(f"Запросов: {args.requests}, ошибок: {errors}")
+    print("Ответили: " + ", ".join(f"{name} - {count}" for name, count in sorted(served.items())))
+    for stats in model.client.get_stats()["instances"]:
+        name = next((stub.name for stub in stubs if stub.url == stats["url"]), "down")
+        print(f"{name}: запросов {stats['requests']}, ошибок подряд {stats['failures']}, исключён {stats['ejected']}")
+
+    if errors or not served.get("b") or not served.get("c"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
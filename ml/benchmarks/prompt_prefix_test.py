@@ -0,0 +1,88 @@
+"""
+Сравнение времени обработки промпта (prompt_eval_duration) в Ollama для двух
+раскладок промпта плана урока.
+
+before - прежняя раскладка: данные запроса (тема, интересы) в начале промпта,
+за ними инструкции и формат ответа, всё в поле prompt, keep_alive по
+умолчанию. after - постоянные инструкции в поле system, данные запроса после
+них, keep_alive из LLM_KEEP_ALIVE. Во втором случае общий префикс
+запросов совпадает и Ollama не пересчитывает его.
+
+Модель генерирует один токен, так что время ответа - почти только
+обработка промпта. Первый запрос каждой серии (загрузка модели) не
+учитывается. Нужна запущенная Ollama с моделью GENERATING_MODEL.
+
+Запуск из каталога ml:
+    python -m benchmarks.prompt_prefix_test --requests 20
+"""
+import os
+import sys
+import argparse
+import statistics
+import ollama
+from utils import env
+from models.baseline import GENERATION_OPTIONS
+from models.prompt_builder import compact
+
+# PromptTemplates импортируется как ml.prompt_templates
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from ml.prompt_templates import PromptTemplates
+
+TOPICS = ["Present Simple", "Past Simple", "Articles", "Modal verbs", "Future forms"]
+INTERESTS = ["музыка", "футбол", "кино", "путешествия", "программирование", "кулинария"]
+
+
+def lesson_parameters(i):
+    return {
+        "topic": f"{TOPICS[i % len(TOPICS)]} ({i})",
+        "student_profile": {
+            "interests": INTERESTS[i % len(INTERESTS)],
+            "knowledge_gaps": [TOPICS[(i + 1) % len(TOPICS)]]
+        }
+    }
+
+
+def request(layout, i, lesson_type):
+    system = compact(PromptTemplates.lesson_plan_system(lesson_type))
+    prompt = compact(PromptTemplates.lesson_plan_prompt(lesson_parameters(i), lesson_type))
+    if layout == "before":
+        return {"prompt": prompt + "\n\n" + system}
+    return {"system": system, "prompt": prompt, "keep_alive": env.LLM_KEEP_ALIVE}
+
+
+def run(client, layout, n_requests, lesson_type):
+    durations = []
+    counts = []
+    for i in range(n_requests + 1):
+        response = client.generate(
+            model=env.GENERATING_MODEL,
+            options={**GENERATION_OPTIONS, 'num_predict': 1},
+            **request(layout, i, lesson_type)
+        )
+        if i:
+            durations.append(response['prompt_eval_duration'] / 1e6)
+            counts.append(response['prompt_eval_count'])
+    return durations, counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--lesson-type", default="theory", choices=["theory", "reading", "speaking", "test"])
+    args = parser.parse_args()
+
+    client = ollama.Client(host=env.OLLAMA_URL)
+    results = {}
+    for layout in ("before", "after"):
+        durations, counts = run(client, layout, args.requests, args.lesson_type)
+        results[layout] = statistics.mean(durations)
+        print(f"{layout}: prompt_eval_duration mean {statistics.mean(durations):.1f} мс, "
+              f"p50 {statistics.median(durations):.1f} мс; "
+              f"обработано токенов промпта в среднем {statistics.mean(counts):.0f}")
+
+    print(f"Ускорение обработки промпта: {results['before'] / max(results['after'], 1e-9):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
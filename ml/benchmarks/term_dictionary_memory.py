@@ -0,0 +1,98 @@
+"""
+Память словарей терминов для множества курсов.
+
+Строит лексические индексы для --courses синтетических курсов. Словари
+курсов пересекаются так же, как у реальных: частые слова (по закону Ципфа)
+общие для всех курсов, плюс немного специфичных терминов у каждого курса.
+Сравнивает прежнюю схему - отдельный словарь dict термин -> id со своими
+строками в каждом курсе - с общим TermDictionary и int32-массивами id в
+индексах курсов.
+
+Запуск из каталога ml:
+    python -m benchmarks.term_dictionary_memory --courses 500
+"""
+import sys
+import time
+import argparse
+import numpy as np
+from api.vector_db.index import TfidfIndex
+from api.vector_db.terms import TermDictionary
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "tra", "ver", "son", "ду", "ма", "ли", "ре", "ство", "ние", "ка"]
+
+
+def make_words(n, rng):
+    words = set()
+    while len(words) < n:
+        words.add("".join(rng.choice(SYLLABLES, size=rng.integers(2, 6))))
+    return sorted(words)
+
+
+def make_courses(n_courses, n_docs, doc_length, common, specific, rng):
+    # Ранги частых слов по Ципфу: первые слова встречаются во всех курсах
+    ranks = np.minimum(rng.zipf(1.3, size=n_courses * n_docs * doc_length) - 1, len(common) - 1)
+    ranks = ranks.reshape(n_courses, n_docs, doc_length)
+    courses = []
+    for course in range(n_courses):
+        own = [f"{word}{course}" for word in rng.choice(specific, size=50)]
+        courses.append([
+            " ".join([common[rank] for rank in ranks[course, doc]] + list(rng.choice(own, size=5)))
+            for doc in range(n_docs)
+        ])
+    return courses
+
+
+def per_course_dicts(courses, analyzer):
+    usage = 0
+    for documents in courses:
+        vocabulary = {}
+        for text in documents:
+            for term in analyzer(text):
+                vocabulary.setdefault(term, len(vocabulary))
+        usage += sys.getsizeof(vocabulary) + sum(sys.getsizeof(term) for term in vocabulary)
+    return usage
+
+
+def shared_dictionary(courses):
+    dictionary = TermDictionary()
+    indexes = []
+    for documents in courses:
+        index = TfidfIndex()
+        index.dictionary = dictionary
+        index.add(documents)
+        indexes.append(index)
+    course_usage = sum(index.term_ids.nbytes + index._sorted_ids.nbytes + index._sorted_local.nbytes for index in indexes)
+    return dictionary, course_usage, sum(index.n_terms for index in indexes)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--courses", type=int, default=500)
+    parser.add_argument("--docs", type=int, default=40, help="документов в курсе")
+    parser.add_argument("--doc-length", type=int, default=80, help="слов в документе")
+    parser.add_argument("--vocabulary", type=int, default=20000, help="частых слов, общих для курсов")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    common = make_words(args.vocabulary, rng)
+    specific = make_words(2000, rng)
+    courses = make_courses(args.courses, args.docs, args.doc_length, common, specific, rng)
+
+    started = time.perf_counter()
+    before = per_course_dicts(courses, TfidfIndex().analyzer)
+    before_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    dictionary, course_usage, course_terms = shared_dictionary(courses)
+    after_time = time.perf_counter() - started
+    after = dictionary.memory_usage() + course_usage
+
+    print(f"Курсов: {args.courses}, терминов в курсах суммарно: {course_terms}, уникальных: {len(dictionary)}")
+    print(f"Словари по курсам: {before / 2**20:.1f} МБ ({before_time:.1f} с)")
+    print(f"Общий словарь: {dictionary.memory_usage() / 2**20:.1f} МБ + массивы id курсов {course_usage / 2**20:.1f} МБ "
+          f"= {after / 2**20:.1f} МБ ({after_time:.1f} с, с построением индексов)")
+    print(f"Экономия: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Нагрузочная проверка VectorStore: писатели и читатели работают одновременно.
+
+Каждый загружаемый текст содержит уникальный маркер. Лексические бэкенды ищут
+по маркеру, плотный - по полному тексту, и в обоих случаях первый результат
+обязан быть этим текстом. Несовпадение означает, что поиск увидел
+рассогласованные индекс и список документов.
+
+Запуск из каталога ml:
+    python -m benchmarks.vector_store_stress --backend bm25 --seconds 10
+"""
+import argparse
+import random
+import tempfile
+import threading
+import time
+from api.vector_db.vector_store import VectorStore
+
+WORDS = ["grammar", "present", "simple", "past", "future", "article", "family", "hobby", "work", "travel"]
+
+
+def make_text(marker):
+    return " ".join(random.choices(WORDS, k=40)) + f" marker{marker}"
+
+
+def writer(store, counter, lock, stop, batch_size, loaded):
+    while not stop.is_set():
+        with lock:
+            start = counter[0]
+            counter[0] += batch_size
+        texts = [make_text(start + i) for i in range(batch_size)]
+        store.add_documents([{"text": text} for text in texts])
+        loaded.append(texts)
+
+
+def reader(store, stop, loaded, latencies, errors):
+    while not stop.is_set():
+        if not loaded:
+            continue
+        text = random.choice(random.choice(loaded))
+        query = text if store.backend == "dense" else text.split()[-1]
+        started = time.perf_counter()
+        results = store.search_batch([query, "present simple"], k=3)
+        latencies.append(time.perf_counter() - started)
+        if not results[0] or results[0][0]["document"]["text"] != text:
+            errors.append(query)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", default="tfidf")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as base_path:
+        store = VectorStore("stress", base_path=base_path, backend=args.backend)
+        counter, counter_lock, stop = [0], threading.Lock(), threading.Event()
+        loaded, latencies, errors = [], [], []
+
+        threads = [
+            threading.Thread(target=writer, args=(store, counter, counter_lock, stop, args.batch_size, loaded))
+            for _ in range(args.writers)
+        ] + [
+            threading.Thread(target=reader, args=(store, stop, loaded, latencies, errors))
+            for _ in range(args.readers)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if store._compaction is not None:
+            store._compaction.join()
+
+        latencies.sort()
+        print(f"Бэкенд: {args.backend}")
+        print(f"Документов загружено: {len(store.documents)}, сегментов: {len(store.segments)}")
+        print(f"Поисков: {len(latencies)}")
+        if latencies:
+            print(f"Задержка поиска p50: {latencies[len(latencies) // 2] * 1000:.2f} мс, "
+                  f"p99: {latencies[int(len(latencies) * 0.99)] * 1000:.2f} мс")
+        print(f"Рассогласованных результатов: {len(errors)}")
+        if errors:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
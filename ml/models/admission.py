@@ -0,0 +1,198 @@
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import CancelledError
+from contextlib import contextmanager, asynccontextmanager
+from utils import env
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+# Порядок обслуживания: свободный слот достаётся первому непустому классу
+PRIORITIES = (INTERACTIVE, BATCH)
+
+
+class Overloaded(Exception):
+    """
+    Запрос к модели не допущен к генерации: status - HTTP-статус ответа
+    (429 - очередь класса заполнена, 503 - запрос не успеет выполниться
+    до срока), retry_after - через сколько секунд стоит повторить.
+    """
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionController:
+    """
+    Ограничение числа одновременных генераций с очередями по классам приоритета.
+
+    Генерацию одновременно выполняют не больше limit запросов, остальные
+    ждут в очереди своего класса. Освободившийся слот получает самый старый
+    запрос interactive и только при их отсутствии - batch. Длина очереди
+    класса ограничена queue_limits (сверх неё - отказ 429). У запроса есть
+    срок timeouts[класс] секунд: если по оценке (среднее время генерации и
+    число запросов впереди) он не успевает, то отклоняется сразу или
+    снимается с очереди (503), а не ждёт, пока истечёт время у клиента.
+    Ожидание с событием cancel прерывается CancelledError, как только
+    событие выставлено и вызван wake().
+    """
+
+    def __init__(self, limit=None, queue_limits=None, timeouts=None):
+        self.limit = limit or env.LLM_MAX_CONCURRENCY
+        self.queue_limits = queue_limits or {INTERACTIVE: env.LLM_QUEUE_INTERACTIVE, BATCH: env.LLM_QUEUE_BATCH}
+        self.timeouts = timeouts or {INTERACTIVE: env.LLM_DEADLINE_INTERACTIVE, BATCH: env.LLM_DEADLINE_BATCH}
+        self.active = 0
+        self.queues = {priority: deque() for priority in PRIORITIES}
+        # Скользящее среднее времени, на которое запрос занимает слот
+        self.service_time = 0.0
+        self.stats = {priority: {"admitted": 0, "queue_full": 0, "deadline": 0} for priority in PRIORITIES}
+        self._changed = threading.Condition()
+
+    @contextmanager
+    def admit(self, priority=INTERACTIVE, cancel=None):
+        """Слот генерации на время блока with; нет слота до срока - исключение Overloaded."""
+        self._acquire(priority, cancel)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._leave(time.monotonic() - started)
+                self._changed.notify_all()
+
+    def _acquire(self, priority, cancel=None):
+        deadline = time.monotonic() + self.timeouts[priority]
+        with self._changed:
+            ticket = self._enter(priority, deadline)
+            try:
+                while ticket is not None and (remaining := self._poll(priority, ticket, deadline, cancel)) is not None:
+                    self._changed.wait(remaining)
+            except BaseException:
+                self._discard(priority, ticket)
+                raise
+            finally:
+                # Голова очереди сменилась: следующий ожидающий может занять свободный слот
+                self._changed.notify_all()
+
+    def wake(self):
+        """Будит ожидающих, чтобы они проверили свои события cancel."""
+        with self._changed:
+            self._changed.notify_all()
+
+    def _ahead(self, priority):
+        """Число ожидающих в очередях классов не ниже priority."""
+        return sum(len(self.queues[p]) for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+
+    def _estimate(self, ahead):
+        """Оценка ожидания слота, если впереди в очереди ahead запросов."""
+        if self.active < self.limit and not ahead:
+            return 0.0
+        return (ahead + 1) * self.service_time / self.limit
+
+    def _enter(self, priority, deadline):
+        """None - слот получен сразу, иначе место в очереди класса; при отказе - Overloaded."""
+        ahead = self._ahead(priority)
+        if self.active < self.limit and not ahead:
+            self._admit(priority)
+            return None
+
+        wait = self._estimate(ahead)
+        if len(self.queues[priority]) >= self.queue_limits[priority]:
+            self.stats[priority]["queue_full"] += 1
+            raise Overloaded(f"Too many queued {priority} requests", 429, wait)
+        if time.monotonic() + wait + self.service_time > deadline:
+            self.stats[priority]["deadline"] += 1
+            raise Overloaded(f"The {priority} request cannot be finished before its deadline", 503, wait)
+
+        ticket = object()
+        self.queues[priority].append(ticket)
+        return ticket
+
+    def _poll(self, priority, ticket, deadline, cancel=None):
+        """None - слот получен, иначе сколько ещё можно ждать; срок уже не выдержать - Overloaded."""
+        if cancel is not None and cancel.is_set():
+            self.queues[priority].remove(ticket)
+            raise CancelledError()
+        head = next((queue[0] for queue in self.queues.values() if queue), None)
+        if self.active < self.limit and head is ticket:
+            self.queues[priority].popleft()
+            self._admit(priority)
+            return None
+
+        remaining = deadline - time.monotonic() - self.service_time
+        if remaining <= 0:
+            self.queues[priority].remove(ticket)
+            self.stats[priority]["deadline"] += 1
+            raise Overloaded(
+                f"The {priority} request cannot be finished before its deadline",
+                503,
+                self._estimate(self._ahead(priority))
+            )
+        return remaining
+
+    def _discard(self, priority, ticket):
+        if ticket in self.queues[priority]:
+            self.queues[priority].remove(ticket)
+
+    def _admit(self, priority):
+        self.active += 1
+        self.stats[priority]["admitted"] += 1
+
+    def _leave(self, duration):
+        self.active -= 1
+        self.service_time = 0.8 * self.service_time + 0.2 * duration if self.service_time else duration
+
+    def get_stats(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "service_time": round(self.service_time, 3),
+            "classes": {
+                priority: {
+                    **self.stats[priority],
+                    "queued": len(self.queues[priority]),
+                    "queue_limit": self.queue_limits[priority],
+                    "timeout": self.timeouts[priority]
+                }
+                for priority in PRIORITIES
+            }
+        }
+
+
+class AsyncAdmissionController(AdmissionController):
+    """То же для корутин одного цикла событий; отмена ожидающей корутины снимает её с очереди."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._changed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def admit(self, priority=INTERACTIVE):
+        await self._acquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self._leave(time.monotonic() - started)
+                self._changed.notify_all()
+
+    async def _acquire(self, priority):
+        deadline = time.monotonic() + self.timeouts[priority]
+        async with self._changed:
+            ticket = self._enter(priority, deadline)
+            try:
+                while ticket is not None and (remaining := self._poll(priority, ticket, deadline)) is not None:
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                self._discard(priority, ticket)
+                raise
+            finally:
+                self._changed.notify_all()
@@ -0,0 +1,126 @@
+import ollama
+import asyncio
+from utils import env
+from models.baseline import BaselineModel
+from models.json_stream import JsonObjectTracker
+from models.single_flight import AsyncSingleFlight
+from models.ollama_pool import AsyncOllamaPool
+from models.admission import AsyncAdmissionController, Overloaded, INTERACTIVE
+
+
+class _SectionFailed(Exception):
+    """Раздел полного урока вернул ошибку."""
+
+
+class AsyncBaselineModel(BaselineModel):
+    """
+    BaselineModel на ollama.AsyncClient для async-обработчиков FastAPI.
+
+    Промпты строятся теми же методами generate_*, но здесь они возвращают
+    корутины, а stream_lesson_plan - асинхронный генератор. Пауза между
+    попытками - asyncio.sleep, а обращения к кэшу ответов идут в потоке,
+    поэтому ни ожидание модели, ни диск не блокируют остальные запросы воркера.
+    """
+
+    client_class = ollama.AsyncClient
+    pool_class = AsyncOllamaPool
+    single_flight_class = AsyncSingleFlight
+    admission_class = AsyncAdmissionController
+
+    async def generate_response(self, prompt, max_retries=3, use_cache=False, bypass_cache=False, schema=None, system=None,
+                                priority=INTERACTIVE):
+        return await self.single_flight.do(
+            (self._key(prompt, schema, system), priority, bypass_cache),
+            lambda: self._generate_response(prompt, max_retries, use_cache, bypass_cache, schema, system, priority)
+        )
+
+    async def _generate_response(self, prompt, max_retries, use_cache, bypass_cache, schema, system, priority):
+        async for event, data in self.stream_response(prompt, max_retries, use_cache, bypass_cache, schema, system, priority):
+            if event == "result":
+                return data
+            if event == "error":
+                return {"error": data}
+
+    async def stream_response(self, prompt, max_retries=3, use_cache=False, bypass_cache=False, schema=None, system=None,
+                              priority=INTERACTIVE):
+        key = self._key(prompt, schema, system) if use_cache else None
+        # Кэш в SQLite: чтение и запись уходят в поток, чтобы не держать цикл событий
+        cached = await asyncio.to_thread(self._cached, key, bypass_cache) if key is not None else None
+        if cached is not None:
+            yield "result", cached
+            return
+
+        for attempt in range(max_retries):
+            if attempt:
+                yield "retry", attempt + 1
+            try:
+                parsed = None
+                result = []
+                async with self.admission.admit(priority):
+                    tracker = JsonObjectTracker()
+                    stream = await self.client.generate(**self._request(prompt, schema, system))
+                    try:
+                        async for part in stream:
+                            result.append(part['response'])
+                            yield "chunk", part['response']
+                            parsed = self._parse_chunk(tracker, part['response'])
+                            if parsed is not None:
+                                break
+                    finally:
+                        await stream.aclose()
+
+                if parsed is None:
+                    parsed = self._parse_response(''.join(result))
+
+                if parsed is None:
+                    print(f"Attempt {attempt + 1}: No JSON found in response")
+                    print(f"Raw response: {''.join(result)}")
+                elif self._validate(parsed, schema):
+                    if key is not None:
+                        await asyncio.to_thread(self.cache.put, key, parsed)
+                    yield "result", parsed
+                    return
+
+            except Overloaded:
+                raise
+            except Exception as e:
+                print(f"Attempt {attempt + 1} failed: {str(e)}")
+                await asyncio.sleep(2)
+
+        yield "error", "Failed to generate valid response after retries"
+
+    async def _generate_full_lesson(self, lesson_input, bypass_cache, priority=None):
+        # Ограничение на запрос, а не на воркер: разделы разных уроков ждут только допуска
+        sections = asyncio.Semaphore(env.LESSON_PLAN_WORKERS)
+        results = {}
+
+        async def generate(section, data=lesson_input):
+            async with sections:
+                results[section] = await self.generate_lesson_plan(data, section, bypass_cache, priority)
+            if "error" in results[section]:
+                # Остальные разделы отменяются: урок без этого раздела всё равно не собрать
+                raise _SectionFailed()
+            return results[section]
+
+        async def theory_and_test():
+            theory = await generate("theory")
+            await generate("test", self._with_theory(lesson_input, theory))
+
+        try:
+            async with asyncio.TaskGroup() as group:
+                group.create_task(theory_and_test())
+                group.create_task(generate("reading"))
+                group.create_task(generate("speaking"))
+        except BaseExceptionGroup as group:
+            # Отказ в допуске и прочие исключения разделов - как у отдельного раздела, без группы
+            errors = [error for error in group.exceptions if not isinstance(error, _SectionFailed)]
+            if errors:
+                raise errors[0]
+        return self._assemble_lesson(results)
+
+    async def is_available(self):
+        try:
+            await self.client.show(self.model_name)
+            return True
+        except Exception:
+            return False
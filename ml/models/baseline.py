@@ -2,81 +2,416 @@ import ollama
 import json
 import time
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
 from utils import env
+from models.response_cache import ResponseCache
+from models.json_stream import JsonObjectTracker
+from models.single_flight import SingleFlight
+from models.json_salvage import repair, salvage_json
+from models.prompt_builder import PromptBuilder
+from models.ollama_pool import OllamaPool
+from models.admission import AdmissionController, Overloaded, INTERACTIVE, BATCH
+from api.vector_db.chunking import chunk_text
+
+GENERATION_OPTIONS = {
+    'temperature': 0.3,
+    'top_p': 0.9,
+    'num_predict': 2000
+}
+
+LESSON_SECTIONS = ("theory", "reading", "speaking", "test")
+FULL_LESSON = "full"
+LESSON_TYPES = LESSON_SECTIONS + (FULL_LESSON,)
 
 class BaselineModel:
-    def __init__(self, model_name="deepseek-r1:8b"):
+    client_class = ollama.Client
+    pool_class = OllamaPool
+    single_flight_class = SingleFlight
+    admission_class = AdmissionController
+
+    def __init__(self, model_name="deepseek-r1:8b", cache=None, cached_endpoints=None, structured=None, stores=None):
         self.model_name = model_name
-        self.client = ollama.Client(host=env.OLLAMA_URL)
+        # Реестр векторных хранилищ курсов: из него берутся материалы для промптов
+        self.stores = stores
+        self.prompts = PromptBuilder()
+        # Ответ ограничивается JSON Schema шаблона (format в Ollama) вместо примера в промпте
+        self.structured = env.LLM_STRUCTURED_OUTPUT if structured is None else structured
+        # Пул серверов из OLLAMA_URLS с интерфейсом клиента ollama
+        self.client = self.pool_class(env.OLLAMA_URLS, self.client_class)
+        self.cache = cache or ResponseCache()
+        if cached_endpoints is None:
+            cached_endpoints = [name.strip() for name in env.LLM_CACHE_ENDPOINTS.split(',') if name.strip()]
+        self.cached_endpoints = set(cached_endpoints)
+        self.single_flight = self.single_flight_class()
+        # Допуск к Ollama: генерации из batch_endpoints уступают слоты интерактивным
+        self.admission = self.admission_class()
+        self.batch_endpoints = {name.strip() for name in env.LLM_BATCH_ENDPOINTS.split(',') if name.strip()}
+        self.parse_stats = {"parsed": 0, "salvaged": 0, "failed": 0, "invalid": 0}
+        self._stats_lock = threading.Lock()
+
+    def generate_response(self, prompt, max_retries=3, use_cache=False, bypass_cache=False, schema=None, system=None,
+                          priority=INTERACTIVE):
+        """
+        use_cache - брать ответ из кэша и сохранять в него удачные ответы;
+        bypass_cache - не читать кэш (ответ всё равно будет сохранён);
+        schema - имя схемы из prompt_schemas: генерация ограничивается ею,
+        а ответ, который ей не соответствует, считается неудачной попыткой;
+        system - постоянная часть промпта (поле system Ollama);
+        priority - класс допуска (admission.INTERACTIVE или BATCH).
+
+        Одновременные вызовы с тем же промптом, классом и bypass_cache ждут
+        одну общую генерацию. Если слот генерации не освободился вовремя,
+        исключение Overloaded.
+        """
+        # Класс входит в ключ: batch не должен ждать в очереди interactive и наоборот;
+        # bypass_cache - тоже: запрос без кэша не должен получить ответ из кэша
+        return self.single_flight.do(
+            (self._key(prompt, schema, system), priority, bypass_cache),
+            lambda: self._generate_response(prompt, max_retries, use_cache, bypass_cache, schema, system, priority)
+        )
+
+    def _generate_response(self, prompt, max_retries, use_cache, bypass_cache, schema, system, priority, cancel=None):
+        for event, data in self.stream_response(prompt, max_retries, use_cache, bypass_cache, schema, system, priority, cancel):
+            if event == "result":
+                return data
+            if event == "error":
+                return {"error": data}
 
-    def generate_response(self, prompt, max_retries=3):
+    def stream_response(self, prompt, max_retries=3, use_cache=False, bypass_cache=False, schema=None, system=None,
+                        priority=INTERACTIVE, cancel=None):
+        """
+        Генерирует ответ потоком событий (event, data): ("chunk", текст),
+        ("retry", номер попытки), в конце ("result", JSON) или ("error", текст).
+        cancel - threading.Event: когда он выставлен, генерация обрывается
+        (в том числе ожидание слота) и поток заканчивается ошибкой.
+
+        Генерация прерывается, как только закрылся JSON-объект верхнего
+        уровня: текст, который модель пишет после него, не ждём. Слот
+        генерации занимает каждая попытка отдельно, ответ из кэша - ни одна.
+        """
+        key = self._key(prompt, schema, system) if use_cache else None
+        cached = self._cached(key, bypass_cache)
+        if cached is not None:
+            yield "result", cached
+            return
+
+        cancelled = cancel.is_set if cancel is not None else lambda: False
         for attempt in range(max_retries):
+            if cancelled():
+                break
+            if attempt:
+                yield "retry", attempt + 1
             try:
-                response = self.client.generate(
-                    model=self.model_name,
-                    prompt=prompt,
-                    options={
-                        'temperature': 0.3,
-                        'top_p': 0.9,
-                        'num_predict': 2000
-                    }
-                )
-                
-                result = response['response']
-                json_match = re.search(r'\{.*\}', result, re.DOTALL)
-                
-                if json_match:
-                    json_str = json_match.group()
-                    return json.loads(json_str)
-                else:
+                parsed = None
+                result = []
+                # Слот занят только на время попытки: пауза перед повтором его не держит
+                with self.admission.admit(priority, cancel):
+                    tracker = JsonObjectTracker()
+                    stream = self.client.generate(**self._request(prompt, schema, system))
+                    try:
+                        for part in stream:
+                            result.append(part['response'])
+                            yield "chunk", part['response']
+                            parsed = self._parse_chunk(tracker, part['response'])
+                            if parsed is not None or cancelled():
+                                break
+                    finally:
+                        # Закрытие потока рвёт соединение, и Ollama прекращает генерацию
+                        stream.close()
+
+                if cancelled():
+                    break
+                if parsed is None:
+                    parsed = self._parse_response(''.join(result))
+
+                if parsed is None:
                     print(f"Attempt {attempt + 1}: No JSON found in response")
-                    print(f"Raw response: {result}")
-                    
+                    print(f"Raw response: {''.join(result)}")
+                elif self._validate(parsed, schema):
+                    if key is not None:
+                        self.cache.put(key, parsed)
+                    yield "result", parsed
+                    return
+
+            except Overloaded:
+                raise
+            except CancelledError:
+                break
             except Exception as e:
                 print(f"Attempt {attempt + 1} failed: {str(e)}")
                 time.sleep(2)
-        
-        return {"error": "Failed to generate valid response after retries"}
+
+        yield "error", "Generation cancelled" if cancelled() else "Failed to generate valid response after retries"
     
-    def generate_entry_test(self, course_data):
+    def _key(self, prompt, schema, system=None):
+        options = dict(GENERATION_OPTIONS)
+        if schema is not None:
+            options['format'] = schema
+        if system is not None:
+            options['system'] = system
+        return self.cache.key(self.model_name, prompt, options)
+
+    def _request(self, prompt, schema, system=None):
+        # keep_alive держит модель и её KV-кэш с общим префиксом загруженными между запросами
+        request = {
+            'model': self.model_name,
+            'prompt': prompt,
+            'options': GENERATION_OPTIONS,
+            'stream': True,
+            'keep_alive': env.LLM_KEEP_ALIVE
+        }
+        if system is not None:
+            request['system'] = system
+        if schema is not None:
+            from ml.prompt_schemas import SCHEMAS
+            request['format'] = SCHEMAS[schema]
+        return request
+
+    def _validate(self, parsed, schema):
+        """Ответ, не прошедший проверку схемой, отбрасывается (будет новая попытка)."""
+        if schema is None:
+            return True
+        from ml.prompt_schemas import validator
+
+        error = next(validator(schema).iter_errors(parsed), None)
+        if error is None:
+            return True
+        self._count("invalid")
+        print(f"Attempt rejected, response does not match schema {schema}: {error.message}")
+        return False
+
+    def _schema(self, name):
+        return name if self.structured else None
+
+    def _cached(self, key, bypass_cache):
+        if key is None:
+            return None
+        if bypass_cache:
+            self.cache.bypass()
+            return None
+        return self.cache.get(key)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.parse_stats[name] += 1
+
+    def _parse_chunk(self, tracker, text):
+        """Первый разобранный (при необходимости починенный) JSON-объект, закрывшийся в этом куске потока."""
+        for candidate in tracker.feed(text):
+            try:
+                parsed = json.loads(candidate)
+                self._count("parsed")
+                return parsed
+            except json.JSONDecodeError:
+                parsed = repair(candidate)
+                if parsed is not None:
+                    self._count("salvaged")
+                    return parsed
+        return None
+
+    def _parse_response(self, result):
+        """
+        Разбор ответа, в котором объект так и не закрылся целиком. Ответ,
+        который строгий разбор (регулярка + json.loads) отверг бы, а
+        salvage_json восстановил, засчитывается как сэкономленная попытка.
+        """
+        json_match = re.search(r'\{.*\}', result, re.DOTALL)
+        if json_match:
+            try:
+                parsed = json.loads(json_match.group())
+                self._count("parsed")
+                return parsed
+            except json.JSONDecodeError:
+                pass
+
+        parsed = salvage_json(result)
+        self._count("failed" if parsed is None else "salvaged")
+        return parsed
+
+    def get_parse_stats(self):
+        with self._stats_lock:
+            return {**self.parse_stats, "retries_saved": self.parse_stats["salvaged"]}
+
+    def _generate(self, prompt, endpoint, bypass_cache, schema=None, system=None, priority=None):
+        if priority is None:
+            priority = BATCH if endpoint in self.batch_endpoints else INTERACTIVE
+        return self.generate_response(
+            prompt,
+            use_cache=endpoint in self.cached_endpoints,
+            bypass_cache=bypass_cache,
+            schema=self._schema(schema),
+            system=system,
+            priority=priority
+        )
+
+    def _passages(self, course_id, query, fallback):
+        """
+        Материалы для промпта и признак ordered для PromptBuilder.build:
+        лучшие пассажи курса из векторного хранилища по убыванию
+        полезности, а без них - текст fallback, разбитый на пассажи по
+        порядку без перекрытия (ordered=True).
+        """
+        store = self.stores.get(course_id) if self.stores is not None and course_id is not None else None
+        if store is not None:
+            results = store.search(query, env.PROMPT_CONTEXT_PASSAGES)
+            if results:
+                return [result['document']['text'] for result in results], False
+        return [chunk['text'] for chunk in chunk_text(str(fallback), overlap=0)] if fallback else [], True
+
+    def generate_entry_test(self, course_data, bypass_cache=False, priority=None):
         from ml.prompt_templates import PromptTemplates
         
-        prompt = PromptTemplates.entry_test_prompt(
-            course_data['course_title'],
-            course_data['topics'],
-            str(course_data.get('materials', ''))
+        topics = course_data['topics']
+        passages, ordered = self._passages(
+            course_data.get('course_id'),
+            f"{course_data['course_title']} {' '.join(map(str, topics))}",
+            course_data.get('materials', '')
+        )
+        system, prompt = self.prompts.build(
+            PromptTemplates.entry_test_system(structured=self.structured),
+            lambda materials: PromptTemplates.entry_test_prompt(
+                course_data['course_title'],
+                topics,
+                materials,
+                course_data.get('interests')
+            ),
+            passages,
+            ordered
         )
         
-        return self.generate_response(prompt)
+        return self._generate(prompt, "entry_test", bypass_cache, "entry_test", system, priority)
     
-    def generate_course_graph(self, graph_input):
+    def generate_course_graph(self, graph_input, bypass_cache=False, priority=None):
         from ml.prompt_templates import PromptTemplates
         
-        prompt = PromptTemplates.course_graph_prompt(
-            graph_input['student_profile'],
-            graph_input['course_title'], 
-            graph_input['topics']
+        system, prompt = self.prompts.build(
+            PromptTemplates.course_graph_system(structured=self.structured),
+            lambda _: PromptTemplates.course_graph_prompt(
+                graph_input['student_profile'],
+                graph_input['course_title'], 
+                graph_input['topics']
+            )
         )
         
-        return self.generate_response(prompt)
+        return self._generate(prompt, "course_graph", bypass_cache, "course_graph", system, priority)
     
-    def generate_lesson_plan(self, lesson_input, lesson_type):
+    def _lesson_plan_prompt(self, lesson_input, lesson_type):
         from ml.prompt_templates import PromptTemplates
         
-        prompt = PromptTemplates.lesson_plan_prompt(
-            lesson_input['lesson_parameters'],
-            lesson_type,
-            lesson_input.get('theory', '')
+        # Теория для тестового урока обрезается по бюджету с начала текста
+        return self.prompts.build(
+            PromptTemplates.lesson_plan_system(lesson_type, structured=self.structured),
+            lambda theory: PromptTemplates.lesson_plan_prompt(
+                lesson_input['lesson_parameters'],
+                lesson_type,
+                theory
+            ),
+            *self._passages(None, None, lesson_input.get('theory', ''))
+        )
+    
+    @staticmethod
+    def _check_lesson_type(lesson_type):
+        # Без этой проверки неизвестный тип падает KeyError на схеме в каждой попытке генерации
+        if lesson_type not in LESSON_TYPES:
+            raise ValueError(f"Unknown lesson type: {lesson_type}, expected one of {', '.join(LESSON_TYPES)}")
+
+    def generate_lesson_plan(self, lesson_input, lesson_type, bypass_cache=False, priority=None):
+        self._check_lesson_type(lesson_type)
+        if lesson_type == FULL_LESSON:
+            return self._generate_full_lesson(lesson_input, bypass_cache, priority)
+        system, prompt = self._lesson_plan_prompt(lesson_input, lesson_type)
+        return self._generate(prompt, "lesson_plan", bypass_cache, f"lesson_plan:{lesson_type}", system, priority)
+    
+    def _generate_full_lesson(self, lesson_input, bypass_cache, priority=None):
+        """
+        Все разделы урока отдельными запросами: теория, чтение и говорение
+        параллельно, тест - после теории, по её тексту. Каждый раздел
+        проверяется своей схемой и повторяется независимо от остальных.
+
+        Разделы урока идут в собственном пуле запроса (не больше
+        LESSON_PLAN_WORKERS одновременно) и сами проходят допуск, так что
+        ожидание раздела учитывают очередь и сроки admission. Как только
+        раздел не удался, остальные отменяются: их результат уже не нужен.
+        """
+        if priority is None:
+            priority = BATCH if "lesson_plan" in self.batch_endpoints else INTERACTIVE
+        cancel = threading.Event()
+
+        def stop():
+            cancel.set()
+            self.admission.wake()
+
+        def generate(section, data=lesson_input):
+            system, prompt = self._lesson_plan_prompt(data, section)
+            # Без single-flight: отмена раздела не должна обрывать чужие одинаковые запросы
+            try:
+                result = self._generate_response(
+                    prompt, 3, "lesson_plan" in self.cached_endpoints, bypass_cache,
+                    self._schema(f"lesson_plan:{section}"), system, priority, cancel
+                )
+            except BaseException:
+                stop()
+                raise
+            if "error" in result:
+                stop()
+            return result
+
+        with ThreadPoolExecutor(max_workers=env.LESSON_PLAN_WORKERS) as sections:
+            futures = {section: sections.submit(generate, section) for section in LESSON_SECTIONS if section != "test"}
+            try:
+                theory = futures["theory"].result()
+                if "error" not in theory:
+                    futures["test"] = sections.submit(generate, "test", self._with_theory(lesson_input, theory))
+                results = {section: future.result() for section, future in futures.items()}
+            except BaseException:
+                stop()
+                for future in futures.values():
+                    future.cancel()
+                raise
+
+        return self._assemble_lesson(results)
+
+    @staticmethod
+    def _with_theory(lesson_input, theory):
+        section = theory.get('theory_section')
+        content = section.get('content') if isinstance(section, dict) else None
+        return {**lesson_input, 'theory': content or lesson_input.get('theory', '')}
+
+    @staticmethod
+    def _assemble_lesson(results):
+        """Разделы объединяются в один ответ с теми же ключами, что у отдельных типов урока."""
+        failed = [section for section in LESSON_SECTIONS if section not in results or 'error' in results[section]]
+        if failed:
+            return {"error": f"Failed to generate lesson sections: {', '.join(failed)}"}
+
+        lesson = {}
+        for section in LESSON_SECTIONS:
+            lesson.update(results[section])
+        return lesson
+    
+    def stream_lesson_plan(self, lesson_input, lesson_type, bypass_cache=False):
+        self._check_lesson_type(lesson_type)
+        if lesson_type == FULL_LESSON:
+            raise ValueError("Full lesson is not streamed, use /generate/lesson-plan")
+        system, prompt = self._lesson_plan_prompt(lesson_input, lesson_type)
+        return self.stream_response(
+            prompt,
+            use_cache="lesson_plan" in self.cached_endpoints,
+            bypass_cache=bypass_cache,
+            schema=self._schema(f"lesson_plan:{lesson_type}"),
+            system=system
         )
-        
-        return self.generate_response(prompt)
     
-    def evaluate_lesson_results(self, evaluation_input):
+    def evaluate_lesson_results(self, evaluation_input, bypass_cache=False, priority=None):
         from ml.prompt_templates import PromptTemplates
         
-        prompt = PromptTemplates.lesson_evaluation_prompt(
-            evaluation_input,
-            evaluation_input.get('test', {})
+        system, prompt = self.prompts.build(
+            PromptTemplates.lesson_evaluation_system(structured=self.structured),
+            lambda _: PromptTemplates.lesson_evaluation_prompt(
+                evaluation_input,
+                evaluation_input.get('test', {})
+            )
         )
         
-        return self.generate_response(prompt)
+        return self._generate(prompt, "evaluate_lesson_results", bypass_cache, "lesson_evaluation", system, priority)
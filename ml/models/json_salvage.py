@@ -0,0 +1,134 @@
+import re
+import json
+
+THINK_BLOCK = re.compile(r'<think>.*?(</think>|$)', re.DOTALL)
+TRAILING_COMMA = re.compile(r',\s*$')
+SMART_QUOTES = '“”„'
+
+_decoder = json.JSONDecoder()
+
+
+def strip_think(text):
+    """Убирает рассуждения reasoning-моделей: <think>...</think> (и незакрытый <think> до конца)."""
+    return THINK_BLOCK.sub('', text)
+
+
+def _decode_objects(text):
+    """
+    Все JSON-объекты, которые разбираются raw_decode с очередной '{', и
+    позиция первой '{', с которой объект не разобрался (или None).
+    """
+    objects = []
+    broken = None
+    position = text.find('{')
+    while position != -1:
+        try:
+            value, end = _decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            if broken is None:
+                broken = position
+            position = text.find('{', position + 1)
+            continue
+        if isinstance(value, dict):
+            objects.append((end - position, value))
+        position = text.find('{', end)
+    return objects, broken
+
+
+def _close(prefix, stack):
+    prefix = TRAILING_COMMA.sub('', prefix.rstrip())
+    if prefix.endswith(':'):
+        prefix += ' null'
+    return prefix + ''.join(reversed(stack))
+
+
+def repair(text):
+    """
+    Чинит типичные дефекты объекта, начинающегося с первой '{': висячие
+    запятые, типографские кавычки вместо ASCII и обрыв посередине (открытые
+    строки, массивы и объекты закрываются, недописанный элемент отбрасывается).
+    Возвращает разобранный объект или None.
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    text = text[start:]
+
+    out = []
+    stack = []
+    cuts = []
+    in_string = escape = smart = False
+    for char in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"' and smart:
+                # Внутри строки в типографских кавычках ASCII-кавычка - часть текста
+                char = '\\"'
+            elif char == '"' or (smart and char in SMART_QUOTES):
+                char = '"'
+                in_string = False
+            out.append(char)
+            continue
+
+        if char == '"' or char in SMART_QUOTES:
+            # Типографские кавычки считаются кавычками JSON только вне строк
+            smart = char != '"'
+            char = '"'
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+        elif char in '}]':
+            if not stack or stack[-1] != char:
+                break
+            # Висячая запятая перед закрывающей скобкой
+            while out and (out[-1].isspace() or out[-1] == ','):
+                out.pop()
+            stack.pop()
+            out.append(char)
+            if not stack:
+                break
+            continue
+        elif char == ',':
+            # Точка, до которой можно обрезать недописанный хвост
+            cuts.append((len(out), list(stack)))
+        out.append(char)
+
+    candidate = ''.join(out)
+    if not stack:
+        attempts = [candidate]
+    else:
+        if in_string:
+            candidate += '"'
+        attempts = [_close(candidate, stack)]
+        attempts += [_close(candidate[:position], cut_stack) for position, cut_stack in reversed(cuts)]
+
+    for attempt in attempts:
+        try:
+            value = json.loads(attempt)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, dict):
+            return value
+    return None
+
+
+def salvage_json(text):
+    """
+    Терпимое извлечение JSON-объекта из ответа модели: без блоков <think>,
+    самый длинный из объектов, которые разбираются как есть, или починенный,
+    если он длиннее.
+    Возвращает объект или None.
+    """
+    text = strip_think(text)
+    objects, broken = _decode_objects(text)
+    best = max(objects, key=lambda item: item[0], default=(0, None))
+
+    # Целые объекты могут оказаться вложенными в повреждённый внешний
+    if broken is not None:
+        repaired = repair(text[broken:])
+        if repaired is not None and len(json.dumps(repaired, ensure_ascii=False)) > best[0]:
+            return repaired
+    return best[1]
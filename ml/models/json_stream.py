@@ -0,0 +1,56 @@
+class JsonObjectTracker:
+    """
+    Следит за глубиной фигурных скобок в потоке текста модели.
+
+    Скобки внутри JSON-строк (с учётом экранирования) и в рассуждениях
+    <think>...</think> не считаются. feed() возвращает тексты объектов
+    верхнего уровня, закрывшихся в очередном куске потока.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.thinking = False
+        self._recent = ""
+        self._pieces = []
+
+    def feed(self, text):
+        objects = []
+        start = 0 if self.depth else None
+        for i, char in enumerate(text):
+            if not self.depth:
+                # Теги могут прийти разрезанными между кусками потока
+                self._recent = (self._recent + char)[-len("</think>"):]
+                if self.thinking:
+                    self.thinking = not self._recent.endswith("</think>")
+                    continue
+                if self._recent.endswith("<think>"):
+                    self.thinking = True
+                    continue
+                if char == '{':
+                    self.depth = 1
+                    start = i
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                self.depth += 1
+            elif char == '}':
+                self.depth -= 1
+                if not self.depth:
+                    objects.append(''.join(self._pieces) + text[start:i + 1])
+                    self._pieces = []
+                    start = None
+
+        if self.depth:
+            self._pieces.append(text[start:])
+        return objects
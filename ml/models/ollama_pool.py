@@ -0,0 +1,262 @@
+import threading
+import httpx
+import ollama
+from utils import env
+
+# Ошибки соединения, после которых запрос можно повторить на другом сервере
+CONNECTION_ERRORS = (ConnectionError, httpx.TransportError)
+_END = object()
+
+
+def _model_tag(name):
+    return name if ':' in name else f"{name}:latest"
+
+
+class OllamaInstance:
+    """Один сервер Ollama: клиент, счётчики запросов и результат последней проверки."""
+
+    def __init__(self, url, client_class, probe_timeout):
+        self.url = url
+        self.client = client_class(host=url)
+        self.probe_client = ollama.Client(host=url, timeout=probe_timeout)
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.ejected = False
+        self.loaded = set()
+
+    def get_stats(self):
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejected": self.ejected,
+            "loaded_models": sorted(self.loaded)
+        }
+
+
+class OllamaPool:
+    """
+    Несколько серверов Ollama за интерфейсом ollama.Client (generate, show).
+
+    Запрос уходит на сервер, где модель уже загружена (по /api/ps), пока у
+    него меньше num_parallel незавершённых запросов; когда такие серверы
+    заняты, - на наименее загруженный из остальных исправных, и модель
+    загружается и там. Ошибка соединения засчитывается серверу, и запрос
+    повторяется на следующем. После max_failures ошибок подряд (запросов или
+    фоновых проверок) сервер исключается, пока проверка не пройдёт снова.
+    """
+
+    def __init__(self, urls=None, client_class=ollama.Client, probe_interval=None, max_failures=None, probe_timeout=2.0,
+                 num_parallel=None):
+        urls = env.OLLAMA_URLS if urls is None else urls
+        self.instances = [OllamaInstance(url, client_class, probe_timeout) for url in urls]
+        self.probe_interval = env.OLLAMA_PROBE_INTERVAL if probe_interval is None else probe_interval
+        self.max_failures = max_failures or env.OLLAMA_MAX_FAILURES
+        self.num_parallel = num_parallel or env.OLLAMA_NUM_PARALLEL
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if self.probe_interval > 0:
+            threading.Thread(target=self._probe_loop, name="ollama-probe", daemon=True).start()
+
+    def _acquire(self, model, tried):
+        """Лучший ещё не опробованный сервер; его счётчик незавершённых запросов увеличивается."""
+        tag = _model_tag(model)
+        with self._lock:
+            available = [instance for instance in self.instances if instance not in tried]
+            # Если исключены все, пробуем их: лучше попытка, чем гарантированный отказ
+            candidates = [instance for instance in available if not instance.ejected] or available
+            if not candidates:
+                return None
+            # Загруженная модель важнее очереди, только пока сервер не занят полностью
+            instance = min(candidates, key=lambda i: (
+                not (tag in i.loaded and i.outstanding < self.num_parallel),
+                i.outstanding,
+                tag not in i.loaded,
+                i.requests
+            ))
+            instance.outstanding += 1
+            instance.requests += 1
+            return instance
+
+    def _release(self, instance, failed=False):
+        with self._lock:
+            instance.outstanding -= 1
+            self._record(instance, failed)
+
+    def _record(self, instance, failed):
+        if failed:
+            instance.failures += 1
+            if instance.failures >= self.max_failures:
+                instance.ejected = True
+        else:
+            instance.failures = 0
+
+    def generate(self, **request):
+        tried, error = [], None
+        while (instance := self._acquire(request.get('model', ''), tried)) is not None:
+            tried.append(instance)
+            try:
+                response = instance.client.generate(**request)
+                if not request.get('stream'):
+                    self._release(instance)
+                    return response
+                # Потоковый запрос соединяется при первом чтении: ошибку соединения ловим здесь
+                first = next(response, _END)
+            except CONNECTION_ERRORS as e:
+                self._release(instance, failed=True)
+                error = e
+                continue
+            except Exception:
+                self._release(instance)
+                raise
+            return PooledStream(self, instance, response, first)
+        raise error or ConnectionError("No Ollama instances configured")
+
+    def show(self, model):
+        tried, error = [], None
+        while (instance := self._acquire(model, tried)) is not None:
+            tried.append(instance)
+            try:
+                response = instance.client.show(model)
+            except CONNECTION_ERRORS as e:
+                self._release(instance, failed=True)
+                error = e
+                continue
+            except Exception:
+                self._release(instance)
+                raise
+            self._release(instance)
+            return response
+        raise error or ConnectionError("No Ollama instances configured")
+
+    def probe(self, instance):
+        """Проверка сервера через /api/ps: доступность и загруженные модели."""
+        try:
+            models = instance.probe_client.ps().models
+        except Exception:
+            with self._lock:
+                self._record(instance, failed=True)
+            return False
+
+        with self._lock:
+            self._record(instance, failed=False)
+            instance.ejected = False
+            instance.loaded = {model.model or model.name for model in models}
+        return True
+
+    def _probe_loop(self):
+        while True:
+            for instance in self.instances:
+                self.probe(instance)
+            if self._stop.wait(self.probe_interval):
+                return
+
+    def close(self):
+        self._stop.set()
+
+    def get_stats(self):
+        with self._lock:
+            return {"instances": [instance.get_stats() for instance in self.instances]}
+
+
+class PooledStream:
+    """Поток ответа сервера пула: запрос снимается с сервера, когда поток исчерпан или закрыт."""
+
+    def __init__(self, pool, instance, stream, first):
+        self.pool = pool
+        self.instance = instance
+        self._stream = stream
+        self._pending = [] if first is _END else [first]
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._pending:
+            return self._pending.pop()
+        try:
+            return next(self._stream)
+        except StopIteration:
+            self._release()
+            raise
+        except CONNECTION_ERRORS:
+            self._release(failed=True)
+            raise
+
+    def _release(self, failed=False):
+        if not self._released:
+            self._released = True
+            self.pool._release(self.instance, failed)
+
+    def close(self):
+        self._release()
+        self._stream.close()
+
+
+class AsyncOllamaPool(OllamaPool):
+    """OllamaPool поверх ollama.AsyncClient; проверки серверов идут в фоновом потоке."""
+
+    def __init__(self, urls=None, client_class=ollama.AsyncClient, **kwargs):
+        super().__init__(urls, client_class, **kwargs)
+
+    async def generate(self, **request):
+        tried, error = [], None
+        while (instance := self._acquire(request.get('model', ''), tried)) is not None:
+            tried.append(instance)
+            try:
+                response = await instance.client.generate(**request)
+                if not request.get('stream'):
+                    self._release(instance)
+                    return response
+                first = await anext(response, _END)
+            except CONNECTION_ERRORS as e:
+                self._release(instance, failed=True)
+                error = e
+                continue
+            except Exception:
+                self._release(instance)
+                raise
+            return AsyncPooledStream(self, instance, response, first)
+        raise error or ConnectionError("No Ollama instances configured")
+
+    async def show(self, model):
+        tried, error = [], None
+        while (instance := self._acquire(model, tried)) is not None:
+            tried.append(instance)
+            try:
+                response = await instance.client.show(model)
+            except CONNECTION_ERRORS as e:
+                self._release(instance, failed=True)
+                error = e
+                continue
+            except Exception:
+                self._release(instance)
+                raise
+            self._release(instance)
+            return response
+        raise error or ConnectionError("No Ollama instances configured")
+
+
+class AsyncPooledStream(PooledStream):
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._pending:
+            return self._pending.pop()
+        try:
+            return await anext(self._stream)
+        except StopAsyncIteration:
+            self._release()
+            raise
+        except CONNECTION_ERRORS:
+            self._release(failed=True)
+            raise
+
+    async def aclose(self):
+        self._release()
+        await self._stream.aclose()
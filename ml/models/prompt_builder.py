@@ -0,0 +1,52 @@
+import re
+from utils import env
+
+TOKEN = re.compile(r'\w+|[^\w\s]')
+BLANK_LINES = re.compile(r'\n{3,}')
+SPACES = re.compile(r'[ \t]+')
+
+
+def count_tokens(text):
+    """
+    Оценка числа токенов без токенизатора модели: слово или знак - токен,
+    длинные слова (особенно кириллица) режутся на части по ~6 символов.
+    """
+    return sum(1 + len(token) // 6 for token in TOKEN.findall(text))
+
+
+def compact(text):
+    """Убирает отступы шаблонов, повторные пробелы и лишние пустые строки."""
+    lines = [SPACES.sub(' ', line).strip() for line in text.split('\n')]
+    return BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip()
+
+
+class PromptBuilder:
+    """
+    Сборка промпта в пределах бюджета токенов.
+
+    render(context) возвращает текст промпта с подставленным контекстом.
+    Контекст набирается из passages в порядке их ранга, пока промпт вместе
+    с system укладывается в бюджет; пассаж, который уже не помещается,
+    пропускается. ordered=True - passages это части одного текста по
+    порядку: набор останавливается на первой непоместившейся, чтобы в
+    промпт не попал текст с пропуском в середине. Возвращает (system, prompt).
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget or env.PROMPT_TOKEN_BUDGET
+
+    def build(self, system, render, passages=(), ordered=False):
+        system = compact(system)
+        remaining = self.budget - count_tokens(system) - count_tokens(compact(render("")))
+
+        selected = []
+        for passage in passages:
+            passage = compact(passage)
+            cost = count_tokens(passage) + 1
+            if passage and cost <= remaining:
+                selected.append(passage)
+                remaining -= cost
+            elif ordered:
+                break
+
+        return system, compact(render("\n\n".join(selected)))
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from utils import env
+
+
+class ResponseCache:
+    """
+    Дисковый кэш ответов модели в SQLite.
+
+    Ключ - sha256 от (модель, промпт, параметры генерации). Записи старше
+    ttl не отдаются; при превышении max_entries удаляются давно не
+    использованные (LRU по времени последнего обращения).
+    """
+
+    def __init__(self, path=None, max_entries=None, ttl=None):
+        self.path = path or env.LLM_CACHE_PATH
+        self.max_entries = max_entries or env.LLM_CACHE_MAX_ENTRIES
+        self.ttl = ttl or env.LLM_CACHE_TTL
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "bypassed": 0, "writes": 0, "evictions": 0}
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._connection.commit()
+
+    @staticmethod
+    def key(model_name, prompt, options):
+        payload = json.dumps([model_name, prompt, options], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+
+            response, created = row
+            if created + self.ttl < now:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+
+            self._connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self.stats["hits"] += 1
+            return json.loads(response)
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(response, ensure_ascii=False), now, now)
+            )
+            self.stats["writes"] += 1
+
+            count = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                self._connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+                self.stats["evictions"] += count - self.max_entries
+            self._connection.commit()
+
+    def bypass(self):
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": entries,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0
+            }
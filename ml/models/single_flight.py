@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Склейка одинаковых одновременных вызовов: пока вызов с ключом key
+    выполняется, остальные вызовы с тем же ключом ждут его и получают
+    тот же результат (или то же исключение).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "executions": 0, "deduplicated": 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            self.stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["executions"] += 1
+            else:
+                self.stats["deduplicated"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "in_flight": len(self._calls)}
+
+
+class AsyncSingleFlight(SingleFlight):
+    """
+    То же для корутин одного цикла событий. Отмена одного ожидающего
+    (клиент ушёл) не отменяет общую генерацию, а уход последнего - отменяет:
+    иначе брошенный запрос дождётся слота в очереди допуска и займёт его.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._waiters = {}
+
+    async def do(self, key, fn):
+        with self._lock:
+            self.stats["calls"] += 1
+            task = self._calls.get(key)
+            if task is None:
+                task = self._calls[key] = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda _: self._forget(key, task))
+                self.stats["executions"] += 1
+            else:
+                self.stats["deduplicated"] += 1
+            self._waiters[task] = self._waiters.get(task, 0) + 1
+
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            with self._lock:
+                last = self._waiters[task] == 1
+            if last:
+                # Новые вызовы с этим ключом начнут генерацию заново, а не получат отмену
+                self._forget(key, task)
+                task.cancel()
+            raise
+        finally:
+            with self._lock:
+                self._waiters[task] -= 1
+                if not self._waiters[task]:
+                    del self._waiters[task]
+
+    def _forget(self, key, task):
+        # Ключ мог уже занять новый вызов, если этот был отменён
+        with self._lock:
+            if self._calls.get(key) is task:
+                del self._calls[key]
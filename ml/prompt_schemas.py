@@ -0,0 +1,95 @@
+from functools import lru_cache
+from jsonschema.validators import validator_for
+
+# JSON Schema ответов для каждого шаблона из prompt_templates.py.
+# Передаются в параметр format Ollama (генерация ограничивается схемой)
+# и проверяют разобранный ответ.
+
+def _object(properties, required=None):
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": required or list(properties)
+    }
+
+STRING = {"type": "string"}
+STRINGS = {"type": "array", "items": STRING}
+INDEX = {"type": "integer", "minimum": 0}
+
+QUESTION = {
+    "anyOf": [
+        _object({
+            "question_id": STRING,
+            "type": {"const": "short_answer"},
+            "question": STRING,
+            "max_length": {"type": "integer"},
+            "correct_answer": STRING
+        }),
+        _object({
+            "question_id": STRING,
+            "type": {"const": "single_choice"},
+            "question": STRING,
+            "options": STRINGS,
+            "correct_answer": INDEX
+        }),
+        _object({
+            "question_id": STRING,
+            "type": {"const": "multiple_choice"},
+            "question": STRING,
+            "options": STRINGS,
+            "correct_answers": {"type": "array", "items": INDEX}
+        }),
+        _object({
+            "question_id": STRING,
+            "type": {"const": "gaps_choice"},
+            "question": STRING,
+            "gaps": {
+                "type": "array",
+                "items": _object({
+                    "gap_id": {"type": "integer"},
+                    "options": STRINGS,
+                    "correct_answer": INDEX
+                })
+            }
+        })
+    ]
+}
+
+QUESTIONS = {"type": "array", "items": QUESTION, "minItems": 1}
+
+SCHEMAS = {
+    "entry_test": _object({
+        "questions": QUESTIONS
+    }),
+    "course_graph": _object({
+        "nodes": {"type": "array", "items": _object({"id": STRING, "label": STRING})},
+        "edges": {"type": "array", "items": _object({"from": STRING, "to": STRING})}
+    }),
+    "lesson_plan:theory": _object({
+        "theory_section": _object({"title": STRING, "content": STRING})
+    }),
+    "lesson_plan:reading": _object({
+        "reading_section": _object({"title": STRING, "text": STRING, "comprehension_questions": STRINGS})
+    }),
+    "lesson_plan:speaking": _object({
+        "speaking_section": _object({"title": STRING, "instructions": STRING})
+    }),
+    "lesson_plan:test": _object({
+        "test_section": _object({"title": STRING, "questions": QUESTIONS})
+    }),
+    "lesson_evaluation": _object({
+        "lesson_score": STRING,
+        "knowledge_gaps": STRINGS,
+        "automated_feedback": STRING,
+        "additional_lesson": {"enum": ["True", "False"]}
+    })
+}
+
+
+@lru_cache(maxsize=None)
+def validator(name):
+    """Валидатор схемы, собранный один раз (схема проверяется при сборке)."""
+    schema = SCHEMAS[name]
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
@@ -1,121 +1,123 @@
 import json
 
-class PromptTemplates:
-    
-    @staticmethod
-    def entry_test_prompt(course_title, topics, materials_context):
-        return f"""
-        Ты - эксперт по созданию образовательных тестов. Создай входной тест для курса "{course_title}".
-        
-        ТЕМЫ КУРСА:
-        {json.dumps(topics, ensure_ascii=False, indent=2)}
-        
-        МАТЕРИАЛЫ КУРСА:
-        {materials_context}
-        
-        ТРЕБОВАНИЯ:
-        1. Создай 10-15 вопросов разных типов:
-           - short_answer (короткий ответ)
-           - single_choice (одиночный выбор) 
-           - multiple_choice (множественный выбор)
-           - gaps_choice (заполнение пропусков)
-        
-        2. Вопросы должны охватывать все темы курса
-        3. Время выполнения: 30 минут
-        
-        ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON:
-        {{
-            "questions": [
-                {{
+# Примеры ответа для режима без схемы. В режиме со схемой (structured=True)
+# формат задаёт JSON Schema из prompt_schemas.py, и пример не нужен.
+STRUCTURED_FORMAT = """
+        ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON ПО ЗАДАННОЙ СХЕМЕ.
+        """
+
+QUESTIONS_EXAMPLE = """[
+                {
                     "question_id": "1",
-                    "type": "short_answer", 
+                    "type": "short_answer",
                     "question": "текст вопроса",
                     "max_length": 50,
                     "correct_answer": "правильный ответ"
-                }},
-                {{
+                },
+                {
                     "question_id": "2",
                     "type": "single_choice",
-                    "question": "текст вопроса", 
+                    "question": "текст вопроса",
                     "options": ["вариант1", "вариант2", "вариант3", "вариант4"],
                     "correct_answer": 1
-                }},
-                {{
-                    "question_id": "3", 
+                },
+                {
+                    "question_id": "3",
                     "type": "multiple_choice",
                     "question": "текст вопроса",
                     "options": ["вариант1", "вариант2", "вариант3", "вариант4"],
                     "correct_answers": [0, 2]
-                }},
-                {{
+                },
+                {
                     "question_id": "4",
-                    "type": "gaps_choice", 
+                    "type": "gaps_choice",
                     "question": "текст с [1] пропусками [2]",
                     "gaps": [
-                        {{
+                        {
                             "gap_id": 1,
                             "options": ["вариант1", "вариант2", "вариант3"],
                             "correct_answer": 0
-                        }},
-                        {{
-                            "gap_id": 2, 
+                        },
+                        {
+                            "gap_id": 2,
                             "options": ["вариант1", "вариант2", "вариант3"],
                             "correct_answer": 1
-                        }}
+                        }
                     ]
-                }}
-            ]
-        }}
+                }
+            ]"""
+
+ENTRY_TEST_FORMAT = """
+        ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON:
+        {
+            "questions": """ + QUESTIONS_EXAMPLE + """
+        }
         """
-    
-    @staticmethod
-    def course_graph_prompt(student_profile, course_title, topics):
-        return f"""
-        Ты - эксперт по образовательным траекториям. Создай персонализированный граф обучения.
-        
-        ПРОФИЛЬ УЧЕНИКА:
-        Интересы: {student_profile['interests']}
-        Пробелы в знаниях: {student_profile['knowledge_gaps']}
-        
-        КУРС: {course_title}
-        ТЕМЫ: {topics}
-        
-        ТРЕБОВАНИЯ:
-        1. Создай граф зависимостей между темами
-        2. Учти пробелы в знаниях ученика
-        3. Определи порядок изучения тем
-        
+
+COURSE_GRAPH_FORMAT = """
         ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON:
-        {{
+        {
             "nodes": [
-                {{
+                {
                     "id": "1",
                     "label": "Название темы"
-                }}
+                }
             ],
             "edges": [
-                {{
-                    "from": "1", 
+                {
+                    "from": "1",
                     "to": "2"
-                }}
+                }
             ]
-        }}
-        """
-    
-    @staticmethod
-    def lesson_plan_prompt(lesson_parameters, lesson_type, theory_context=""):
-        student_profile = lesson_parameters['student_profile']
-        
-        base_prompt = f"""
-        Ты - опытный преподаватель. Создай персонализированный план урока.
-        
-        ТЕМА УРОКА: {lesson_parameters['topic']}
-        ИНТЕРЕСЫ УЧЕНИКА: {student_profile['interests']}
-        ПРОБЕЛЫ В ЗНАНИЯХ: {student_profile['knowledge_gaps']}
+        }
         """
-        
-        if lesson_type == "theory":
-            return base_prompt + f"""
+
+LESSON_PLAN_FORMATS = {
+    "theory": """
+            ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON:
+            {
+                "theory_section": {
+                    "title": "Название раздела",
+                    "content": "Текст теории с примерами..."
+                }
+            }
+            """,
+    "reading": """
+            ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON:
+            {
+                "reading_section": {
+                    "title": "Название текста",
+                    "text": "Текст для чтения...",
+                    "comprehension_questions": [
+                        "Вопрос 1?",
+                        "Вопрос 2?",
+                        "Вопрос 3?"
+                    ]
+                }
+            }
+            """,
+    "speaking": """
+            ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON:
+            {
+                "speaking_section": {
+                    "title": "Название задания",
+                    "instructions": "Подробные инструкции..."
+                }
+            }
+            """,
+    "test": """
+            ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON:
+            {
+                "test_section": {
+                    "title": "Название теста",
+                    "questions": """ + QUESTIONS_EXAMPLE + """
+                }
+            }
+            """
+}
+
+LESSON_PLAN_TASKS = {
+    "theory": """
             ТИП УРОКА: Теоретическое занятие
             
             ТРЕБОВАНИЯ:
@@ -123,42 +125,17 @@ class PromptTemplates:
             2. Используй примеры из интересов ученика
             3. Учти пробелы в знаниях
             4. Структурируй материал логически
-            
-            ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON:
-            {{
-                "theory_section": {{
-                    "title": "Название раздела",
-                    "content": "Текст теории с примерами..."
-                }}
-            }}
-            """
-        
-        elif lesson_type == "reading":
-            return base_prompt + f"""
+            """,
+    "reading": """
             ТИП УРОКА: Чтение и понимание
             
             ТРЕБОВАНИЯ:
             1. Напиши интересный текст на тему урока
-            2. Используй vocabulary из интересов ученика  
+            2. Используй vocabulary из интересов ученика
             3. Добавь 3-5 вопросов на понимание
             4. Уровень сложности - соответствующий теме
-            
-            ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON:
-            {{
-                "reading_section": {{
-                    "title": "Название текста",
-                    "text": "Текст для чтения...",
-                    "comprehension_questions": [
-                        "Вопрос 1?",
-                        "Вопрос 2?",
-                        "Вопрос 3?"
-                    ]
-                }}
-            }}
-            """
-        
-        elif lesson_type == "speaking":
-            return base_prompt + """
+            """,
+    "speaking": """
             ТИП УРОКА: Разговорная практика
             
             ТРЕБОВАНИЯ:
@@ -166,88 +143,124 @@ class PromptTemplates:
             2. Тема должна быть связана с интересами ученика
             3. Учти пробелы в знаниях
             4. Дай четкие инструкции
-            
-            ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON:
-            {
-                "speaking_section": {
-                    "title": "Название задания",
-                    "instructions": "Подробные инструкции..."
-                }
-            }
-            """
-        
-        elif lesson_type == "test":
-            return base_prompt + f"""
+            """,
+    "test": """
             ТИП УРОКА: Тестирование
             
-            ТЕОРЕТИЧЕСКАЯ ЧАСТЬ (для справки):
-            {theory_context}
-            
             ТРЕБОВАНИЯ:
             1. Создай тест на 15-20 минут
             2. 5-8 вопросов разных типов
-            3. Вопросы должны проверять понимание теории
+            3. Вопросы должны проверять понимание теоретической части из запроса
             4. Учти интересы ученика в формулировках
-            
-            ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON:
-            {
-                "test_section": {
-                    "title": "Название теста",
-                    "questions": [
-                    {{
-                        "question_id": "1",
-                        "type": "short_answer", 
-                        "question": "текст вопроса",
-                        "max_length": 50,
-                        "correct_answer": "правильный ответ"
-                    }},
-                    {{
-                        "question_id": "2",
-                        "type": "single_choice",
-                        "question": "текст вопроса", 
-                        "options": ["вариант1", "вариант2", "вариант3", "вариант4"],
-                        "correct_answer": 1
-                    }},
-                    {{
-                        "question_id": "3", 
-                        "type": "multiple_choice",
-                        "question": "текст вопроса",
-                        "options": ["вариант1", "вариант2", "вариант3", "вариант4"],
-                        "correct_answers": [0, 2]
-                    }},
-                    {{
-                        "question_id": "4",
-                        "type": "gaps_choice", 
-                        "question": "текст с [1] пропусками [2]",
-                        "gaps": [
-                            {{
-                                "gap_id": 1,
-                                "options": ["вариант1", "вариант2", "вариант3"],
-                                "correct_answer": 0
-                            }},
-                            {{
-                                "gap_id": 2, 
-                                "options": ["вариант1", "вариант2", "вариант3"],
-                                "correct_answer": 1
-                            }}
-                        ]
-                    }}
-                    ]
-                }
-            }
             """
+}
+
+LESSON_EVALUATION_FORMAT = """
+        ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON:
+        {
+            "lesson_score": "8",
+            "knowledge_gaps": ["список пробелов"],
+            "automated_feedback": "текст обратной связи",
+            "additional_lesson": "True/False"
+        }
+        """
+
+class PromptTemplates:
+    """
+    Каждый промпт состоит из двух частей. *_system - постоянные инструкции
+    и формат ответа: передаются в поле system и одинаковы для всех запросов
+    шаблона, поэтому Ollama переиспользует их обработку (общий префикс в
+    KV-кэше). *_prompt - данные конкретного запроса, идут после префикса.
+    """
     
     @staticmethod
-    def lesson_evaluation_prompt(teachers_notes, test_results):
+    def entry_test_system(structured=False):
+        return """
+        Ты - эксперт по созданию образовательных тестов. Создай входной тест для курса по темам и материалам из запроса.
+        
+        ТРЕБОВАНИЯ:
+        1. Создай 10-15 вопросов разных типов:
+           - short_answer (короткий ответ)
+           - single_choice (одиночный выбор)
+           - multiple_choice (множественный выбор)
+           - gaps_choice (заполнение пропусков)
+        
+        2. Вопросы должны охватывать все темы курса
+        3. Время выполнения: 30 минут
+        """ + (STRUCTURED_FORMAT if structured else ENTRY_TEST_FORMAT)
+    
+    @staticmethod
+    def entry_test_prompt(course_title, topics, materials_context, interests=None):
+        prompt = f"""
+        КУРС: "{course_title}"
+        
+        ТЕМЫ КУРСА:
+        {json.dumps(topics, ensure_ascii=False)}
+        """
+        
+        if interests:
+            prompt += f"""
+        ИНТЕРЕСЫ УЧЕНИКА (используй в примерах и формулировках вопросов):
+        {interests}
+        """
+        
+        return prompt + f"""
+        МАТЕРИАЛЫ КУРСА:
+        {materials_context}
+        """
+    
+    @staticmethod
+    def course_graph_system(structured=False):
+        return """
+        Ты - эксперт по образовательным траекториям. Создай персонализированный граф обучения для курса и ученика из запроса.
+        
+        ТРЕБОВАНИЯ:
+        1. Создай граф зависимостей между темами
+        2. Учти пробелы в знаниях ученика
+        3. Определи порядок изучения тем
+        """ + (STRUCTURED_FORMAT if structured else COURSE_GRAPH_FORMAT)
+    
+    @staticmethod
+    def course_graph_prompt(student_profile, course_title, topics):
         return f"""
-        Ты - опытный преподаватель-эксперт. Проанализируй результаты урока и дай оценку.
+        ПРОФИЛЬ УЧЕНИКА:
+        Интересы: {student_profile['interests']}
+        Пробелы в знаниях: {student_profile['knowledge_gaps']}
         
-        ЗАМЕТКИ ПРЕПОДАВАТЕЛЯ:
-        Говорение: {teachers_notes.get('teachers_notes_about_speaking', 'Нет заметок')}
-        Чтение: {teachers_notes.get('teachers_notes_about_reading', 'Нет заметок')}
+        КУРС: {course_title}
+        ТЕМЫ: {topics}
+        """
+    
+    @staticmethod
+    def lesson_plan_system(lesson_type, structured=False):
+        response_format = STRUCTURED_FORMAT if structured else LESSON_PLAN_FORMATS.get(lesson_type, "")
         
-        РЕЗУЛЬТАТЫ ТЕСТА:
-        {json.dumps(test_results, ensure_ascii=False, indent=2)}
+        return """
+        Ты - опытный преподаватель. Создай персонализированный план урока по теме и профилю ученика из запроса.
+        """ + LESSON_PLAN_TASKS.get(lesson_type, "") + response_format
+    
+    @staticmethod
+    def lesson_plan_prompt(lesson_parameters, lesson_type, theory_context=""):
+        student_profile = lesson_parameters['student_profile']
+        
+        prompt = f"""
+        ТЕМА УРОКА: {lesson_parameters['topic']}
+        ИНТЕРЕСЫ УЧЕНИКА: {student_profile['interests']}
+        ПРОБЕЛЫ В ЗНАНИЯХ: {student_profile['knowledge_gaps']}
+        """
+        
+        if lesson_type == "test":
+            prompt += f"""
+            ТЕОРЕТИЧЕСКАЯ ЧАСТЬ (для справки):
+            {theory_context}
+            """
+        
+        return prompt
+    
+    @staticmethod
+    def lesson_evaluation_system(structured=False):
+        return """
+        Ты - опытный преподаватель-эксперт. Проанализируй результаты урока из запроса и дай оценку.
         
         ТРЕБОВАНИЯ:
         1. Проанализируй ошибки в тесте
@@ -255,12 +268,16 @@ class PromptTemplates:
         3. Поставь итоговую оценку от 1 до 10
         4. Определи пробелы в знаниях
         5. Рекомендуй нужен ли ещё дополнительный урок
+        """ + (STRUCTURED_FORMAT if structured else LESSON_EVALUATION_FORMAT)
+    
+    @staticmethod
+    def lesson_evaluation_prompt(teachers_notes, test_results):
+        return f"""
+        ЗАМЕТКИ ПРЕПОДАВАТЕЛЯ:
+        Говорение: {teachers_notes.get('teachers_notes_about_speaking', 'Нет заметок')}
+        Чтение: {teachers_notes.get('teachers_notes_about_reading', 'Нет заметок')}
+        Отзыв об уроке: {teachers_notes.get('lesson_feedback') or 'Нет отзыва'}
         
-        ВЕРНИ ОТВЕТ В ФОРМАТЕ JSON:
-        {
-            "lesson_score": "8",
-            "knowledge_gaps": ["список пробелов"],
-            "automated_feedback": "текст обратной связи", 
-            "additional_lesson": "True/False"
-        }
-        """
\ No newline at end of file
+        РЕЗУЛЬТАТЫ ТЕСТА:
+        {json.dumps(test_results, ensure_ascii=False)}
+        """
@@ -1,5 +1,52 @@
 import os
 
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+OLLAMA_URLS = [url.strip() for url in os.getenv("OLLAMA_URLS", OLLAMA_URL).split(",") if url.strip()]
+OLLAMA_PROBE_INTERVAL = float(os.getenv("OLLAMA_PROBE_INTERVAL", "10"))
+OLLAMA_MAX_FAILURES = int(os.getenv("OLLAMA_MAX_FAILURES", "3"))
+# Сколько запросов сервер Ollama обрабатывает параллельно (его OLLAMA_NUM_PARALLEL)
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "2"))
 PORT = os.getenv("PORT", "8000")
-GENERATING_MODEL = os.getenv("GENERATING_MODEL", "gemma3n:e2b")
\ No newline at end of file
+GENERATING_MODEL = os.getenv("GENERATING_MODEL", "gemma3n:e2b")
+VECTOR_DB_PATH = os.getenv("VECTOR_DB_PATH", "ml/api/vector_db")
+VECTOR_DB_MAX_SEGMENTS = int(os.getenv("VECTOR_DB_MAX_SEGMENTS", "8"))
+VECTOR_DB_UPLOAD_FLUSH_MB = int(os.getenv("VECTOR_DB_UPLOAD_FLUSH_MB", "16"))
+VECTOR_DB_BACKEND = os.getenv("VECTOR_DB_BACKEND", "tfidf")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+DENSE_IVF_MIN_DOCS = int(os.getenv("DENSE_IVF_MIN_DOCS", "20000"))
+DENSE_IVF_LISTS = int(os.getenv("DENSE_IVF_LISTS", "256"))
+DENSE_IVF_PROBE = int(os.getenv("DENSE_IVF_PROBE", "8"))
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "800"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "150"))
+VECTOR_DB_MEMORY_BUDGET_MB = int(os.getenv("VECTOR_DB_MEMORY_BUDGET_MB", "512"))
+VECTOR_DB_QUERY_CACHE_SIZE = int(os.getenv("VECTOR_DB_QUERY_CACHE_SIZE", "10000"))
+VECTOR_DB_QUERY_CACHE_TTL = float(os.getenv("VECTOR_DB_QUERY_CACHE_TTL", "300"))
+VECTOR_DB_FEDERATED_WORKERS = int(os.getenv("VECTOR_DB_FEDERATED_WORKERS", "8"))
+VECTOR_DB_FEDERATED_TIMEOUT = float(os.getenv("VECTOR_DB_FEDERATED_TIMEOUT", "2"))
+VECTOR_DB_DEDUP_DISTANCE = int(os.getenv("VECTOR_DB_DEDUP_DISTANCE", "3"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "ml/api/llm_cache.sqlite3")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_ENDPOINTS = os.getenv("LLM_CACHE_ENDPOINTS", "entry_test,course_graph,lesson_plan")
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "1") == "1"
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2048"))
+PROMPT_CONTEXT_PASSAGES = int(os.getenv("PROMPT_CONTEXT_PASSAGES", "20"))
+# Длительность ("30m", "1h") или число секунд; -1 - не выгружать модель
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")
+if LLM_KEEP_ALIVE.lstrip('-').isdigit():
+    LLM_KEEP_ALIVE = int(LLM_KEEP_ALIVE)
+LESSON_PLAN_WORKERS = int(os.getenv("LESSON_PLAN_WORKERS", "3"))
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "ml/api/jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", str(24 * 3600)))
+JOB_WAIT_TIMEOUT = float(os.getenv("JOB_WAIT_TIMEOUT", "30"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "10"))
+# Одновременных генераций на весь процесс; по умолчанию столько, сколько серверы Ollama обрабатывают параллельно
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", str(OLLAMA_NUM_PARALLEL * len(OLLAMA_URLS))))
+LLM_QUEUE_INTERACTIVE = int(os.getenv("LLM_QUEUE_INTERACTIVE", "16"))
+LLM_QUEUE_BATCH = int(os.getenv("LLM_QUEUE_BATCH", "64"))
+LLM_DEADLINE_INTERACTIVE = float(os.getenv("LLM_DEADLINE_INTERACTIVE", "60"))
+LLM_DEADLINE_BATCH = float(os.getenv("LLM_DEADLINE_BATCH", "600"))
+LLM_BATCH_ENDPOINTS = os.getenv("LLM_BATCH_ENDPOINTS", "evaluate_lesson_results")
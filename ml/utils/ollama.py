@@ -2,10 +2,10 @@ import requests
 import json
 from utils import env
 
-def pull_model(model: str):
+def pull_model(model: str, url: str = None):
     try:
         response = requests.post(
-            url=env.OLLAMA_URL + "/api/pull",
+            url=(url or env.OLLAMA_URL) + "/api/pull",
             json={
                  "model": model,
                  "stream": True